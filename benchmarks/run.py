@@ -0,0 +1,188 @@
+r"""Benchmark suite: slicing, selection, construction and arithmetic across space sizes
+
+Each case is timed (best of several repeats) and its peak traced memory recorded
+(via ``tracemalloc``, which also tracks numpy allocations) on generated spaces of
+increasing size. Results can be saved as a baseline and later compared against it,
+flagging any case which became slower (or hungrier) than the given tolerance.
+Timings depend on the machine: the stored ``baseline.json`` is a reference for the
+default sizes, which should be re-saved (``--save``) before comparing on another machine.
+
+Usage::
+
+  python -m benchmarks.run                          # run with default sizes
+  python -m benchmarks.run --sizes 1e3 1e6 1e8      # up to ~10^8 cells (needs ~4 GB)
+  python -m benchmarks.run --save                   # store results as the baseline
+  python -m benchmarks.run --compare                # exit 1 on regressions vs the baseline
+"""
+import io
+import os
+import sys
+import time
+import argparse
+import tempfile
+import tracemalloc
+import numpy as np
+import simplejson as json
+from ndna.space import Dimension,Space,Array
+from ndna.ops import Selector
+from ndna.parallel import threaded
+from ndna.io import loadjson,savecsv
+
+BASELINE = os.path.join(os.path.dirname(__file__),'baseline.json')
+
+def makespace(cells):
+  r"""Generate a 3-dimensional space with about **cells** cells.
+
+  Dimensions: ``i`` (categorical, 3 values), ``j`` (numeric ages), ``k`` (categorical);
+  ``j`` and ``k`` share the remaining size.
+  """
+  n = max(2,int(round((cells/3)**0.5)))
+  return Space([
+    Dimension('activity','i',['high','medium','low']),
+    Dimension('age','j',list(range(0,10*n,10))),
+    Dimension('group','k',['g{}'.format(v) for v in range(n)]),
+  ])
+
+def cases(space):
+  r"""Return ``{name: (setup, maxcells)}``, where ``setup()`` returns the callable to time."""
+  j = space.dim['j'].values
+  k = space.dim['k'].values
+  # unevenly spaced values, so that selections take the np.ix_ path (not basic slices)
+  some = dict(j=[v for n,v in enumerate(j) if n % 7 in (0,2)],k=[v for n,v in enumerate(k) if n % 5 in (0,1)])
+  def slicer_fast():
+    return lambda: space.compile(i='low',j=j[-1])
+  def slicer_ix():
+    return lambda: space.compile(**some)
+  def slicer_cached():
+    space.slicer(**some)
+    return lambda: space.slicer(**some)
+  def selector(memory):
+    def setup():
+      X = Array(0.,space,['i','j','k'])
+      sel = Selector('s',space,memory=memory,**some)
+      return lambda: sel(X)
+    return setup
+  def new_scalar():
+    return lambda: Array(1.,space,['i','j','k'])
+  def new_data():
+    data = np.ones(space.shape)
+    return lambda: Array(data,space,['i','j','k'])
+  def from_records():
+    columns = next(space.iterblocks(size=int(np.prod(space.shape))))
+    order = np.random.default_rng(0).permutation(len(columns['i']))
+    columns = dict({key: values[order] for key,values in columns.items()},value=np.ones(len(order)))
+    return lambda: Array.fromrecords(columns,space,duplicates='sum')
+  def operators():
+    Xijk = Array(1.,space,['i','j','k'])
+    Xik  = Array(2.,space,['i','k'])
+    Xi   = Array(3.,space,['i'])
+    Xk   = Array(4.,space,['k'])
+    return lambda: Xijk * Xik + Xi - Xk
+  def operators_threaded():
+    run = operators()
+    def fun():
+      with threaded():
+        return run()
+    return fun
+  def coords():
+    X = Array(1.,space,['i','j','k'])
+    return lambda: X.coords()
+  def iterate():
+    return lambda: sum(1 for _ in space.iter())
+  def load_json():
+    fname = os.path.join(tempfile.mkdtemp(),'X.json')
+    with open(fname,'w') as f:
+      json.dump(np.ones(space.shape).tolist(),f)
+    return lambda: loadjson(fname)
+  def save_csv():
+    X = Array(np.ones(space.shape),space,['i','j','k'])
+    return lambda: savecsv(io.StringIO(),X)
+  return {
+    'Space.slicer (fast)':       (slicer_fast,None),
+    'Space.slicer (np.ix_)':     (slicer_ix,None),
+    'Space.slicer (cached)':     (slicer_cached,None),
+    'Selector (memory)':         (selector(True),None),
+    'Selector (no memory)':      (selector(False),None),
+    'Array.__new__ (scalar)':    (new_scalar,None),
+    'Array.__new__ (data)':      (new_data,None),
+    'Array.fromrecords':         (from_records,None),
+    'Array operators':           (operators,None),
+    'Array operators (threaded)':(operators_threaded,None),
+    'Array.coords':              (coords,1e5),
+    'Space.iter':                (iterate,1e6),
+    'io.loadjson':               (load_json,1e6),
+    'io.savecsv':                (save_csv,1e6),
+  }
+
+def measure(fun,repeat=5,budget=1.0):
+  r"""Return (best time per call in seconds, peak traced memory in bytes) of ``fun()``."""
+  tracemalloc.start()
+  fun()
+  peak = tracemalloc.get_traced_memory()[1]
+  tracemalloc.stop()
+  t0 = time.perf_counter()
+  fun()
+  once = time.perf_counter()-t0
+  number = max(1,int(budget/repeat/max(once,1e-9)))
+  best = once
+  for _ in range(repeat):
+    t0 = time.perf_counter()
+    for _ in range(number):
+      fun()
+    best = min(best,(time.perf_counter()-t0)/number)
+  return best,peak
+
+def run(sizes,repeat=5,budget=1.0,select=None):
+  r"""Run all cases (names containing **select**) for each size: ``{size: {case: [time, peak]}}``."""
+  results = {}
+  for size in sizes:
+    space = makespace(size)
+    cells = int(np.prod(space.shape))
+    results[str(size)] = {}
+    for name,(setup,maxcells) in cases(space).items():
+      if (select and select not in name) or (maxcells and cells > maxcells):
+        continue
+      results[str(size)][name] = list(measure(setup(),repeat,budget))
+      print('{:>8} {:<26} {:>12.3e} s {:>12,d} B'.format(
+        '{:.0e}'.format(size),name,*results[str(size)][name]))
+  return results
+
+def compare(results,baseline,tolerance=0.2):
+  r"""Return a list of (size, case, metric, baseline, result) regressions beyond **tolerance**."""
+  regressions = []
+  for size,cases_ in results.items():
+    for name,values in cases_.items():
+      if name not in baseline.get(size,{}):
+        continue
+      for metric,new,old in zip(('time','memory'),values,baseline[size][name]):
+        if new > old*(1+tolerance) and new-old > (1e-6 if metric == 'time' else 4096):
+          regressions.append((size,name,metric,old,new))
+  return regressions
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description='ndna benchmarks')
+  parser.add_argument('--sizes',nargs='+',type=float,default=[1e3,1e5,1e6])
+  parser.add_argument('--repeat',type=int,default=5)
+  parser.add_argument('--budget',type=float,default=0.5,help='seconds per case')
+  parser.add_argument('--select',default=None,help='only run cases containing this text')
+  parser.add_argument('--baseline',default=BASELINE)
+  parser.add_argument('--save',action='store_true',help='save results as the baseline')
+  parser.add_argument('--compare',action='store_true',help='compare results to the baseline')
+  parser.add_argument('--tolerance',type=float,default=0.2)
+  args = parser.parse_args(argv)
+  if args.compare and not args.save and not os.path.exists(args.baseline):
+    print('No baseline at {}: run with --save first to create one'.format(args.baseline))
+    return 2
+  results = run([int(size) for size in args.sizes],args.repeat,args.budget,args.select)
+  if args.save:
+    with open(args.baseline,'w') as f:
+      json.dump(results,f,indent=2)
+  if args.compare:
+    regressions = compare(results,loadjson(args.baseline,ordered=False),args.tolerance)
+    for size,name,metric,old,new in regressions:
+      print('REGRESSION {:>8} {:<26} {}: {:.3e} -> {:.3e}'.format(size,name,metric,old,new))
+    return int(bool(regressions))
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,119 @@
+r"""Incrementally recomputed Arrays: Derived
+"""
+import weakref
+import numpy as np
+from . import space as nspace
+from .space import Array,runslice
+
+# weak sets of the Derived arrays depending on each input (Array or Derived), by id of the input
+dependents = {}
+
+def changed(arr,select):
+  # Array.update hook: mark the dependents of arr dirty within the updated region
+  deps = dependents.get(id(arr))
+  if not deps:
+    return
+  region = {key: np.unique(arr.space.dim[key].indices(values))
+            for key,values in select.items() if key in arr.space.index}
+  for derived in list(deps):
+    derived.mark(region)
+
+def forget(ids):
+  # drop the registry entries of inputs without any remaining dependents
+  for i in ids:
+    if i in dependents and not dependents[i]:
+      del dependents[i]
+
+def regionslicer(shape,keys,region):
+  # slicer of the cells of a canonical array of shape within region = {key: positions}
+  items = [runslice(region[key]) if key in region and n > 1 else slice(None) for key,n in zip(keys,shape)]
+  if sum(not isinstance(item,slice) for item in items) <= 1:
+    return tuple(items)
+  return np.ix_(*[np.arange(n)[item] if isinstance(item,slice) else item for item,n in zip(items,shape)])
+
+class Derived():
+  r"""An Array computed as ``fun(*inputs)``, recomputed incrementally after updates of its inputs.
+
+  Changes to input Arrays made by ``Array.update``, ``updatemany`` or ``updatetable``
+  (not other in-place writes) mark the affected region of the value as dirty.
+  The next :meth:`get` then recomputes **fun** on that region of the inputs only.
+  Inputs may themselves be Derived, forming a dependency graph.
+
+  **fun** must compute each cell from the same cell of the inputs, except along keys which
+  it reduces (absent from the result), or which are listed in **over**. For example,
+  ``Derived(lambda X: X.sum('j'),X)`` or ``Derived(lambda X: X / X.sum('j',keepdims=True),X,over=['j'])``.
+
+  Args:
+    fun (callable): computes the value (an Array) from the inputs
+    *inputs: the operands: writable Arrays, Derived arrays, or other fixed objects
+    over (list): result keys along which **fun** combines cells, which are recomputed in full
+
+  Attributes:
+    counts (dict): number of ``'full'`` and ``'region'`` recomputations
+  """
+  def __init__(self,fun,*inputs,over=()):
+    for arg in inputs:
+      if isinstance(arg,Array) and (not arg.keyed or arg.isbroadcast
+                                    or arg.expand().shape != arg.space.subshape(arg.keys)):
+        raise ValueError('Derived inputs must be whole, writable Arrays (not sliced or broadcast)')
+    self.fun    = fun
+    self.inputs = inputs
+    self.over   = set(over)
+    self.value  = None
+    self.dirty  = None
+    self.counts = {'full':0,'region':0}
+    ids = [id(arg) for arg in inputs if isinstance(arg,(Array,Derived))]
+    weakref.finalize(self,forget,ids)
+    for i in ids:
+      dependents.setdefault(i,weakref.WeakSet()).add(self)
+    nspace.changed = changed
+
+  def __str__(self):
+    return '< Derived {} of {} inputs{} >'.format(
+      getattr(self.fun,'__name__','function'),
+      len(self.inputs),
+      ' (dirty)' if self.value is None or self.dirty is not None else '',
+    )
+
+  def __repr__(self):
+    return str(self)
+
+  def mark(self,region):
+    r"""Mark **region** = ``{key: positions}`` of the inputs dirty (other keys: all positions)."""
+    if self.value is None:
+      return
+    keys = self.value.keys if isinstance(self.value,Array) else []
+    region = {key: pos for key,pos in region.items() if key in keys and key not in self.over}
+    if self.dirty is None:
+      self.dirty = region
+    else:
+      self.dirty = {key: np.union1d(self.dirty[key],region[key]) for key in self.dirty if key in region}
+    for derived in list(dependents.get(id(self),())):
+      derived.mark(region)
+
+  def get(self):
+    r"""Return the up-to-date value, recomputing only what changed since the last call.
+
+    Returns:
+      (Array): the value, which is updated in place by later calls
+    """
+    args = [arg.get() if isinstance(arg,Derived) else arg for arg in self.inputs]
+    if self.value is None or (self.dirty is not None and not self.dirty):
+      value = self.fun(*args)
+      if isinstance(value,Array):
+        value = value.materialize()
+        if any(isinstance(arg,np.ndarray) and np.may_share_memory(value,arg) for arg in args):
+          value = value.copy()
+      self.value = value
+      self.counts['full'] += 1
+    elif self.dirty is not None:
+      keys = self.value.space.keys
+      subs = [arg.expand()[regionslicer(arg.expand().shape,keys,self.dirty)] if isinstance(arg,Array) else arg
+              for arg in args]
+      result = self.fun(*subs)
+      target = self.value.expand()
+      target.view(np.ndarray)[regionslicer(target.shape,keys,self.dirty)] = \
+        np.asarray(result.expand() if isinstance(result,Array) else result)
+      self.counts['region'] += 1
+    self.dirty = None
+    return self.value
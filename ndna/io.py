@@ -2,8 +2,13 @@ r"""I/O functions
 """
 
 import os
+import re
 from collections import OrderedDict as odict
+import numpy as np
 import simplejson as json
+from .space import Dimension,Space,Array,intern
+
+TOKENTAIL = re.compile(rb'[^\s\[\],]*$')
 
 def loadjson(fname, ordered=True):
   r"""Load a JSON file.
@@ -19,6 +24,81 @@ def loadjson(fname, ordered=True):
   with open(fname,'r') as f:
     return json.load(f,**oargs)
 
+def loaddims(fname):
+  r"""Load a dimension-spec file as a list of Dimensions (fast path).
+
+  The file is parsed with plain dicts, which keep their order, avoiding the
+  overhead of building OrderedDicts as in :func:`loadjson`.
+
+  Args:
+    fname (str): a JSON file holding either ``{name: spec, ...}`` or ``[spec, ...]``,
+      where each ``spec`` is ``{'name','key','values'}``
+
+  Returns:
+    (list): the Dimensions, in file order, e.g. for ``Space(loaddims(fname))``
+  """
+  with open(fname,'r') as f:
+    specs = json.load(f)
+  if isinstance(specs,dict):
+    specs = specs.values()
+  return [Dimension(**spec) for spec in specs]
+
+def iterjson(fname,field=None,chunksize=2**20):
+  r"""Iterate over the numbers of a (nested) JSON list, one parsed chunk at a time.
+
+  The file is read in binary chunks, so memory is bounded by **chunksize**
+  rather than the size of the payload. Brackets, commas and whitespace are
+  ignored, so the numbers are yielded in C order; ``null`` is read as ``nan``.
+
+  Args:
+    fname (str): the file to read
+    field (str): the payload is the value of the first ``"field":`` in the file,
+      else the whole file
+    chunksize (int): number of bytes to read at a time
+
+  Yields:
+    (ndarray): float64 values of the next chunk
+  """
+  table = bytes.maketrans(b'[],',b'   ')
+  with open(fname,'rb') as f:
+    buf = f.read(chunksize)
+    if field is not None:
+      pattern = re.compile(rb'"'+re.escape(field.encode())+rb'"\s*:\s*')
+      overlap = len(field)+256
+      while True:
+        match = pattern.search(buf)
+        if match:
+          buf = buf[match.end():] or f.read(chunksize)
+          break
+        chunk = f.read(chunksize)
+        if not chunk:
+          raise ValueError('field "{}" not found in {}'.format(field,fname))
+        buf = buf[-overlap:]+chunk
+    depth,carry = 0,b''
+    while buf:
+      # track bracket depth to stop at the end of the payload
+      chars = np.frombuffer(buf,dtype=np.uint8)
+      level = depth+np.cumsum((chars == ord('[')).astype(np.int8)-(chars == ord(']')))
+      done = False
+      if field is not None:
+        start = 0 if depth else np.argmax(chars == ord('[')) if level.any() else len(buf)
+        end = np.flatnonzero(level[start:] == 0)
+        if len(end):
+          buf,done = buf[:start+end[0]+1],True
+      depth = level[-1]
+      # a number may be split across chunks: carry the tail to the next one
+      text = carry+buf
+      cut = len(text) if done else TOKENTAIL.search(text).start()
+      text,carry = text[:cut],text[cut:]
+      tokens = text.translate(table).replace(b'null',b'nan').split()
+      if tokens:
+        yield np.array(tokens).astype(float)
+      if done:
+        return
+      buf = f.read(chunksize)
+    if carry:
+      yield np.array([carry.replace(b'null',b'nan')]).astype(float)
+
 def makedir(directory):
   r"""Just make the damned directory.
 
@@ -34,3 +114,112 @@ def makedir(directory):
   except FileNotFoundError:
     if not directory:
       raise ValueError('directory argument must not be empty')
+
+def dumpspace(space):
+  r"""Describe a Space as a JSON-serializable list of dimension specs.
+
+  Args:
+    space (Space): the space to describe
+
+  Returns:
+    (list): one ``{'name','key','values'}`` dict per dimension, as accepted by ``Dimension(**spec)``
+  """
+  return [
+    odict([
+      ('name',   dim.name),
+      ('key',    dim.key),
+      ('values', [v.item() if isinstance(v,np.generic) else v for v in dim.values]),
+    ]) for dim in space.dims
+  ]
+
+def savearray(fname,arr):
+  r"""Save an Array and its Space in binary format.
+
+  The data are written as ``fname.npy`` in the canonical layout,
+  and the dimensions and keys as a small JSON header ``fname.json``.
+
+  Args:
+    fname (str): the base file name, without extension
+    arr (Array): the array to save, spanning the whole space over its keys (not sliced)
+  """
+  data = np.asarray(arr.expand())
+  if data.shape != arr.space.subshape(arr.keys):
+    raise ValueError('Cannot save a sliced Array: shape {} vs space shape {}'.format(
+      data.shape,arr.space.subshape(arr.keys)))
+  with open(fname+'.json','w') as f:
+    json.dump(odict([('dims',dumpspace(arr.space)),('keys',list(arr.keys))]),f)
+  np.save(fname+'.npy',data)
+
+def loadarray(fname,mmap_mode=None,space=None):
+  r"""Load an Array saved by :func:`savearray`.
+
+  Args:
+    fname (str): the base file name, without extension
+    mmap_mode (str): passed to ``np.load``, e.g. ``'r'`` to memory-map the data
+      so that only the slices which are touched are read from disk
+    space (Space): an existing space to attach instead of rebuilding it from the header;
+      otherwise the rebuilt space is interned, so arrays loaded with equal spaces share one
+
+  Returns:
+    (Array): the loaded array
+  """
+  header = loadjson(fname+'.json')
+  if space is None:
+    space = intern(Space([Dimension(**spec) for spec in header['dims']]))
+  return Array(np.load(fname+'.npy',mmap_mode=mmap_mode),space,header['keys'])
+
+def loadjsonarray(fname,space,keys,field=None,dtype=float,chunksize=2**20):
+  r"""Stream a numeric JSON payload straight into a preallocated Array.
+
+  Unlike ``Array(loadjson(fname),...)``, no intermediate lists are built:
+  peak memory is the final array plus one chunk (see :func:`iterjson`).
+  The (nested) list must hold exactly the values of the array in C order.
+
+  Args:
+    fname (str): the file to load
+    space (Space): the space of the array
+    keys (list): the keys spanned by the array
+    field (str): read the payload from this field, else the whole file
+    dtype (type): data type of the array
+    chunksize (int): number of bytes to read at a time
+
+  Returns:
+    (Array): the loaded array
+  """
+  out = np.empty(space.subshape(keys),dtype=dtype)
+  flat = out.reshape(-1)
+  n = 0
+  for values in iterjson(fname,field=field,chunksize=chunksize):
+    if n+len(values) > flat.size:
+      raise ValueError('{} has more than {} values for keys {}'.format(fname,flat.size,keys))
+    flat[n:n+len(values)] = values
+    n += len(values)
+  if n != flat.size:
+    raise ValueError('{} has {} values, expected {} for keys {}'.format(fname,n,flat.size,keys))
+  return Array(out,space,keys)
+
+def savecsv(fname,arr,sep=',',header=True,value='value',fmt=None,chunksize=2**16):
+  r"""Write an Array as long-format text rows: one row of labels plus value per cell.
+
+  Rows are formatted and written in chunks, with vectorized number formatting,
+  so memory is bounded by **chunksize**. The columns are the array keys
+  (in space order) and **value**, so the output can be read back with ``Array.fromrecords``.
+
+  Args:
+    fname (str,file): the file name, or a file-like object with a ``write`` method
+    arr (Array): the array to write (not a sliced view)
+    sep (str): the column separator, e.g. ``'\t'`` for TSV
+    header (bool): whether to write a header row of column names
+    value (str): the name of the value column
+    fmt (str): printf-style number format, e.g. ``'%.3f'``, else the shortest repr
+    chunksize (int): number of rows formatted at a time
+  """
+  f = open(fname,'w',newline='') if isinstance(fname,str) else fname
+  try:
+    if header:
+      f.write(sep.join([key for key in arr.space.keys if key in arr.keys]+[value])+'\n')
+    for start in range(0,arr.size,chunksize):
+      f.write('\n'.join(arr.rows(start,start+chunksize,sep=sep,fmt=fmt).tolist())+'\n')
+  finally:
+    if f is not fname:
+      f.close()
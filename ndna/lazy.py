@@ -0,0 +1,142 @@
+r"""Deferred Array arithmetic: expression graphs with fused, chunked evaluation
+"""
+from contextlib import contextmanager
+import numpy as np
+from numpy.lib.mixins import NDArrayOperatorsMixin
+from . import space as nspace
+from .space import Array
+
+class Expr(NDArrayOperatorsMixin):
+  r"""A node in a deferred expression graph.
+
+  Operators and ufuncs applied to an Expr build further nodes instead of computing.
+  Calling :meth:`evaluate` computes the whole graph chunk-by-chunk along one axis,
+  so that intermediate results are only ever chunk-sized, and writes into a single
+  output buffer. Results are identical to eager evaluation.
+
+  Args:
+    ufunc (np.ufunc): the ufunc applied by this node, or ``None`` for a leaf
+    args (tuple): the operands: Expr nodes, Arrays, arrays, or scalars
+    kwargs (dict): extra keyword arguments for **ufunc** (e.g. ``dtype``)
+  """
+  def __init__(self,ufunc,args,kwargs=None):
+    self.ufunc  = ufunc
+    self.args   = tuple(args)
+    self.kwargs = kwargs or {}
+
+  def __array_ufunc__(self,ufunc,method,*inputs,**kwargs):
+    if method != '__call__' or 'out' in kwargs or ufunc.nout != 1:
+      return NotImplemented
+    return Expr(ufunc,inputs,kwargs)
+
+  def __str__(self):
+    def label(arg):
+      if isinstance(arg,Array):
+        return 'Array[{}]'.format(','.join(str(key) for key in arg.keys))
+      if isinstance(arg,np.ndarray):
+        return 'ndarray{}'.format(arg.shape)
+      return str(arg)
+    if self.ufunc is None:
+      return label(self.args[0])
+    return '{}({})'.format(self.ufunc.__name__,', '.join(label(arg) for arg in self.args))
+
+  def __repr__(self):
+    return '< Expr {} >'.format(str(self))
+
+  def leaves(self):
+    r"""Return the unique non-Expr operands of the graph, in order of appearance."""
+    out = {}
+    for arg in self.args:
+      if isinstance(arg,Expr):
+        out.update((id(leaf),leaf) for leaf in arg.leaves())
+      else:
+        out.setdefault(id(arg),arg)
+    return list(out.values())
+
+  def compute(self,views,chunk,out=None):
+    # evaluate the graph on one chunk of the (aligned) leaf views
+    args = [arg.compute(views,chunk) if isinstance(arg,Expr) else chunk(views.get(id(arg),arg))
+            for arg in self.args]
+    if self.ufunc is None:
+      return args[0]
+    if out is None:
+      return self.ufunc(*args,**self.kwargs)
+    return self.ufunc(*args,out=out,**self.kwargs)
+
+  def evaluate(self,chunkbytes=2**20):
+    r"""Evaluate the expression.
+
+    Args:
+      chunkbytes (int): target size in bytes of each chunk of the output
+
+    Returns:
+      (Array): the result, keyed as eager evaluation would be
+    """
+    leaves = self.leaves()
+    arrays = [leaf for leaf in leaves if isinstance(leaf,Array) and leaf.keyed]
+    views,keys = {},None
+    if arrays:
+      space = arrays[0].space
+      expand,keys = space.broadcaster(tuple((space.layout(arr),tuple(arr.keys)) for arr in arrays))
+      views = {id(arr): arr.unwrap(arr,expand) for arr in arrays}
+    views.update((id(leaf),np.asarray(leaf)) for leaf in leaves
+                 if isinstance(leaf,np.ndarray) and id(leaf) not in views)
+    shape = np.broadcast_shapes(*(view.shape for view in views.values()))
+    if not shape or int(np.prod(shape)) <= 1:
+      out = np.asarray(self.compute(views,lambda v: v))
+    else:
+      # chunks are blocks of rows along the outermost axis whose rows fit in chunkbytes,
+      # taken at each position of the axes before it
+      itemsize = max([view.itemsize for view in views.values()]+[8])
+      inner = [int(np.prod(shape[a+1:])) for a in range(len(shape))]
+      axis = next(a for a in range(len(shape)) if inner[a]*itemsize <= chunkbytes or a == len(shape)-1)
+      rows = max(1,chunkbytes // (itemsize*inner[axis]))
+      out = None
+      for index in np.ndindex(*shape[:axis]):
+        for start in range(0,shape[axis],rows):
+          region = tuple(slice(i,i+1) for i in index)+(slice(start,start+rows),)
+          def chunk(v,region=region):
+            if not isinstance(v,np.ndarray):
+              return v
+            offset = len(shape)-v.ndim
+            return v[tuple(slice(None) if v.shape[a-offset] == 1 else region[a] for a in range(offset,axis+1))]
+          if out is None:
+            first = np.asarray(self.compute(views,chunk))
+            out = np.empty(shape,dtype=first.dtype)
+            out[region] = first
+          else:
+            self.compute(views,chunk,out=out[region])
+    if keys is None:
+      return out
+    out = out.view(Array)
+    out.space = arrays[0].space
+    out.keys  = keys
+    return out
+
+def defer(arr):
+  r"""Wrap an Array (or array / scalar) as a leaf of a deferred expression.
+
+  Args:
+    arr (Array): the operand
+
+  Returns:
+    (Expr): a leaf node
+  """
+  return Expr(None,(arr,))
+
+@contextmanager
+def deferred():
+  r"""Context in which ufuncs and operators on Arrays build :class:`Expr` graphs.
+
+  Only code running in this thread (context) is deferred; other threads compute as usual.
+
+  Example:
+    >>> with deferred():
+    ...   Y = Xijk * Xik + Xi - Xk
+    >>> Y = Y.evaluate()
+  """
+  token = nspace.deferral.set(lambda ufunc,inputs,kwargs: Expr(ufunc,inputs,kwargs))
+  try:
+    yield
+  finally:
+    nspace.deferral.reset(token)
@@ -1,8 +1,13 @@
-r"""Operator classes: Selector
+r"""Operator classes: Selector, SelectorSet
 """
 
+import threading
+import numpy as np
 from . import utils
 
+# guards the compiled selections of Selectors shared between threads
+lock = threading.RLock()
+
 class Selector(dict):
   def __init__(self,name,space,memory=True,**select):
     dict.__init__(self)
@@ -11,6 +16,8 @@ class Selector(dict):
     self.space = space
     self.memory = memory
     self.pre = {}
+    self.flat = {}
+    self.positions = None
 
   def __str__(self):
     return '< Selector "{}" {} >'.format(
@@ -22,21 +29,119 @@ class Selector(dict):
     return str(dict(self))
 
   def __call__(self,arr):
-    if arr.shape in self.pre:
-      return arr[self.pre[arr.shape]]
-    elif self.memory:
-      self.register(arr.shape)
-      return arr[self.pre[arr.shape]]
-    else:
-      return arr[self.space.slicer(**self)]
+    slicer = self.pre.get(arr.shape)
+    if slicer is None:
+      if not self.memory:
+        return arr[self.space.slicer(**self)]
+      slicer = self.register(arr.shape)
+    return arr[slicer]
 
   def register(self,shape):
-    self.pre.update({shape: self.space.slicer(**self)})
+    # compile once, even if called from several threads; slicers are shared via space.slicer
+    with lock:
+      if shape not in self.pre:
+        self.pre[shape] = self.space.slicer(**self)
+      return self.pre[shape]
+
+  def locate(self):
+    # positions of the selected values along each selected dimension
+    if self.positions is None:
+      with lock:
+        if self.positions is None:
+          self.positions = {
+            key: self.space.dim[key].indices(values)
+            for key,values in self.items() if key in self.space.dim
+          }
+    return self.positions
+
+  def compile(self,shape):
+    # flat (C-order) indices of the selection within an array of shape
+    flat = self.flat.get(shape)
+    if flat is not None:
+      return flat
+    if len(shape) != self.space.ndim:
+      raise ValueError('Cannot select from shape {}: a canonical shape of {} axes is required (see Array.expand)'.format(
+        shape,self.space.ndim))
+    with lock:
+      if shape in self.flat:
+        return self.flat[shape]
+      positions = self.locate()
+      flat = np.ravel_multi_index(np.ix_(*[
+        positions[key] if key in positions else np.arange(n)
+        for key,n in zip(self.space.keys,shape)
+      ]),shape)
+      if self.memory:
+        self.flat[shape] = flat
+    return flat
+
+  def take(self,arr):
+    # like __call__, but gathering from contiguous data via the compiled flat indices
+    return np.ravel(arr).take(self.compile(arr.shape))
+
+  def put(self,arr,values):
+    # write values into the selection of (contiguous) arr in place
+    flat = self.compile(arr.shape)
+    np.put(arr,flat,np.broadcast_to(values,flat.shape))
+    return arr
 
   def merge(self,selector):
-    assert self.space == selector.space, 'selectors must be part of the same space'
-    return Selector(
+    # selectors are merged onto self.space: labels of a selector on another space are re-located
+    merged = Selector(
       name = self.name+' '+selector.name,
       space = self.space,
       **utils.dictmerge(self,selector),
     )
+    if selector.space == self.space:
+      merged.positions = utils.dictmerge(self.locate(),selector.locate())
+    else:
+      merged.locate()
+    return merged
+
+class SelectorSet(list):
+  def __init__(self,selectors,memory=True):
+    list.__init__(self,selectors)
+    self.memory = memory
+    self.pre = {}
+
+  def __str__(self):
+    return '< SelectorSet [{}] >'.format(
+      ', '.join('"{}"'.format(selector.name) for selector in self),
+    )
+
+  @property
+  def names(self):
+    return [selector.name for selector in self]
+
+  def compile(self,shape):
+    # (concatenated flat indices, offsets, shapes) of all selectors for an array of shape
+    compiled = self.pre.get(shape)
+    if compiled is not None:
+      return compiled
+    with lock:
+      if shape in self.pre:
+        return self.pre[shape]
+      flats = [selector.compile(shape) for selector in self]
+      compiled = (
+        np.concatenate([flat.ravel() for flat in flats]),
+        np.cumsum([0]+[flat.size for flat in flats]),
+        [flat.shape for flat in flats],
+      )
+      if self.memory:
+        self.pre[shape] = compiled
+    return compiled
+
+  def __call__(self,arr):
+    # apply all selectors in one gather: {name: selection}, as views of one buffer
+    flat,offsets,shapes = self.compile(arr.shape)
+    values = np.asarray(arr).ravel().take(flat)
+    return utils.odict([
+      (selector.name,values[start:stop].reshape(shape))
+      for selector,start,stop,shape in zip(self,offsets[:-1],offsets[1:],shapes)
+    ])
+
+  def stack(self,arr):
+    # apply all selectors in one gather, stacked along a new leading axis (see names)
+    flat,_,shapes = self.compile(arr.shape)
+    if len(set(shapes)) > 1:
+      raise ValueError('Cannot stack selections of different shapes: {}'.format(shapes))
+    return np.asarray(arr).ravel().take(flat).reshape((len(self),)+shapes[0])
@@ -0,0 +1,110 @@
+r"""Multi-threaded execution of large Array operations: Threads, threaded
+"""
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from . import space as nspace
+
+# ufuncs whose reductions can be split into partial reductions and combined again
+REORDERABLE = (
+  np.add, np.multiply, np.maximum, np.minimum, np.fmax, np.fmin,
+  np.logical_and, np.logical_or, np.bitwise_and, np.bitwise_or, np.bitwise_xor,
+)
+
+def overlaps(out,arg):
+  # whether chunks of out may overwrite parts of arg read by other chunks (arg is not out itself);
+  # numpy buffers such inputs when run serially
+  return isinstance(arg,np.ndarray) and np.may_share_memory(out,arg) and not (
+    arg.shape == out.shape and arg.strides == out.strides
+    and arg.__array_interface__['data'][0] == out.__array_interface__['data'][0])
+
+class Threads():
+  r"""Runs ufunc calls and reductions in chunks along the leading axis on a thread pool.
+
+  NumPy releases the GIL inside ufunc loops, so the chunks run truly in parallel.
+  Calls on fewer than **minsize** elements, or with arguments which cannot be
+  split safely (e.g. ``where``), run as usual in the calling thread.
+
+  Args:
+    workers (int): number of threads (default: as ``ThreadPoolExecutor``)
+    minsize (int): minimum number of output (call) or input (reduce) elements to split
+  """
+  def __init__(self,workers=None,minsize=2**16):
+    self.pool = ThreadPoolExecutor(workers)
+    self.workers = self.pool._max_workers
+    self.minsize = minsize
+
+  def shutdown(self):
+    self.pool.shutdown()
+
+  def chunks(self,n):
+    # up to one contiguous (start, stop) range of the leading axis per worker
+    bounds = np.linspace(0,n,min(n,self.workers)+1).astype(int)
+    return list(zip(bounds[:-1],bounds[1:]))
+
+  def map(self,fun,chunks):
+    return [future.result() for future in [self.pool.submit(fun,*chunk) for chunk in chunks]]
+
+  def call(self,ufunc,args,kwargs):
+    r"""Equivalent to ``ufunc(*args,**kwargs)`` for plain ndarray / scalar **args**."""
+    # sequences (e.g. nested lists) as arrays, so that they are split like arrays
+    args = [arg if np.ndim(arg) == 0 else np.asarray(arg) for arg in args]
+    shape = np.broadcast_shapes(*[np.shape(arg) for arg in args])
+    out = kwargs.get('out')
+    if ufunc.nout != 1 or 'where' in kwargs or len(shape) == 0 or shape[0] < 2 \
+        or int(np.prod(shape)) < self.minsize or (out is not None and out[0].shape != shape) \
+        or (out is not None and any(overlaps(out[0],arg) for arg in args)):
+      return ufunc(*args,**kwargs)
+    kwargs = {key:value for key,value in kwargs.items() if key != 'out'}
+    if out is None:
+      # the result dtype, from the ufunc applied to one element of each argument
+      first = [arg[(slice(0,1),)*arg.ndim] if isinstance(arg,np.ndarray) else arg for arg in args]
+      out = np.empty(shape,dtype=ufunc(*first,**kwargs).dtype)
+    else:
+      out = out[0]
+    # arguments spanning the leading axis are split, others are broadcast to each chunk
+    split = [isinstance(arg,np.ndarray) and arg.ndim == len(shape) and arg.shape[0] > 1 for arg in args]
+    def task(start,stop):
+      ufunc(*[arg[start:stop] if s else arg for arg,s in zip(args,split)],out=out[start:stop],**kwargs)
+    self.map(task,self.chunks(shape[0]))
+    return out
+
+  def reduce(self,ufunc,arr,axes,kwargs):
+    r"""Equivalent to ``ufunc.reduce(arr,axis=axes,keepdims=True,**kwargs)``."""
+    if arr.ndim == 0 or arr.shape[0] < 2 or arr.size < self.minsize or set(kwargs) - {'dtype'} \
+        or (0 in axes and ufunc not in REORDERABLE):
+      return ufunc.reduce(arr,axis=axes,keepdims=True,**kwargs)
+    def task(start,stop):
+      return ufunc.reduce(arr[start:stop],axis=axes,keepdims=True,**kwargs)
+    parts = self.map(task,self.chunks(arr.shape[0]))
+    if 0 in axes:
+      # combine the partial reductions of each chunk
+      return ufunc.reduce(np.concatenate(parts,axis=0),axis=0,keepdims=True,**kwargs)
+    return np.concatenate(parts,axis=0)
+
+@contextmanager
+def threaded(workers=None,minsize=2**16):
+  r"""Context in which large ufuncs, operators and reductions on Arrays run multi-threaded.
+
+  Work is split along the leading axis of the (canonical) data, one chunk per thread.
+  Only operations in this thread (context) are affected; other threads run as usual.
+  Floating point reductions along the leading axis may differ from serial results by rounding.
+
+  Args:
+    workers (int): number of threads (default: as ``ThreadPoolExecutor``)
+    minsize (int): minimum number of elements for an operation to be split
+
+  Example:
+    >>> with threaded(workers=8):
+    ...   Y = (Xijk * Xik + Xi).sum('j')
+
+  Yields:
+    (Threads): the thread pool in use
+  """
+  pool = Threads(workers,minsize)
+  token = nspace.threads.set(pool)
+  try:
+    yield pool
+  finally:
+    pool.shutdown()
+    nspace.threads.reset(token)
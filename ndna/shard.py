@@ -0,0 +1,147 @@
+r"""Sharded on-disk datasets, partitioned along one dimension: ShardedArray
+"""
+import os
+import numbers
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import simplejson as json
+from .space import Dimension,Space,Array,intern,positions,runslice
+from .io import loadjson,makedir,dumpspace,odict
+
+HEADER = 'index.json'
+
+def shardname(i):
+  # file name of the shard holding position i of the partition dimension
+  return 'shard-{}.npy'.format(i)
+
+def saveshards(dirname,arr,key,workers=None):
+  r"""Save an Array as a directory of shards, one per value of the dimension **key**.
+
+  Each shard ``shard-<position>.npy`` holds the canonical data for one value of **key**,
+  and ``index.json`` holds the dimensions, keys and partition key.
+  Shards are written in parallel by a thread pool.
+
+  Args:
+    dirname (str): the directory to create / write into
+    arr (Array): the array to save, which must span **key**
+    key (str): the key of the partition dimension
+    workers (int): number of threads writing shards (default: as ``ThreadPoolExecutor``)
+  """
+  if key not in arr.keys:
+    raise ValueError('Cannot partition along "{}": not in array keys {}'.format(key,arr.keys))
+  makedir(dirname)
+  data = np.asarray(arr.expand())
+  axis = arr.space.keys.index(key)
+  with open(os.path.join(dirname,HEADER),'w') as f:
+    json.dump(odict([
+      ('dims',dumpspace(arr.space)),
+      ('keys',list(arr.keys)),
+      ('key',key),
+    ]),f)
+  def write(i):
+    np.save(os.path.join(dirname,shardname(i)),np.take(data,[i],axis=axis))
+  with ThreadPoolExecutor(workers) as pool:
+    list(pool.map(write,range(data.shape[axis])))
+
+def loadshards(dirname,mmap_mode=None,space=None):
+  r"""Open a dataset saved by :func:`saveshards`, without reading any shards.
+
+  Args:
+    dirname (str): the dataset directory
+    mmap_mode (str): passed to ``np.load`` when opening each shard
+    space (Space): an existing space to attach instead of rebuilding (and interning) it from the header
+
+  Returns:
+    (ShardedArray): the lazily loaded array
+  """
+  header = loadjson(os.path.join(dirname,HEADER))
+  if space is None:
+    space = intern(Space([Dimension(**spec) for spec in header['dims']]))
+  return ShardedArray(dirname,space,header['keys'],header['key'],mmap_mode=mmap_mode)
+
+class ShardedArray():
+  r"""An ``Array`` stored as one file per value of a partition dimension.
+
+  Selections (``__call__``, ``slice``, ``Selector``) open only the shards they touch,
+  and return an ``Array`` equal to the same selection of the full array.
+
+  Args:
+    dirname (str): the dataset directory (see :func:`saveshards`)
+    space (Space): the space of the array
+    keys (list): the keys spanned by the array
+    key (str): the key of the partition dimension
+    mmap_mode (str): passed to ``np.load`` when opening each shard
+  """
+  def __init__(self,dirname,space,keys,key,mmap_mode=None):
+    self.dirname = dirname
+    self.space = space
+    self.keys  = keys
+    self.key   = key
+    self.axis  = space.keys.index(key)
+    self.shape = space.subshape(keys)
+    self.mmap_mode = mmap_mode
+
+  def __str__(self):
+    return '< ShardedArray [{}] shape {} sharded by "{}" >'.format(
+      ', '.join(str(key) for key in self.keys),
+      self.shape,
+      self.key,
+    )
+
+  def __repr__(self):
+    return str(self)
+
+  def __len__(self):
+    return self.shape[0]
+
+  @property
+  def ndim(self):
+    return len(self.shape)
+
+  def shard(self,i):
+    # the canonical data for position i of the partition dimension
+    return np.load(os.path.join(self.dirname,shardname(i)),mmap_mode=self.mmap_mode)
+
+  def load(self,shards=None):
+    r"""Read the given shard positions (default: all) as one Array along the partition axis."""
+    shards = range(self.shape[self.axis]) if shards is None else shards
+    if len(shards) == 0:
+      out = np.take(self.shard(0),[],axis=self.axis).view(Array)
+    else:
+      out = np.concatenate([self.shard(i) for i in shards],axis=self.axis).view(Array)
+    out.space = self.space
+    out.keys  = self.keys
+    return out
+
+  def __getitem__(self,key):
+    if isinstance(key,dict):
+      return self(**key)
+    if not isinstance(key,tuple):
+      key = (key,)
+    # read only the shards at the selected partition positions, and relocate key into them
+    shards,inverse = np.unique(positions(key,self.shape)[self.axis],return_inverse=True)
+    return self.load(shards)[self.relocate(key,inverse)]
+
+  def relocate(self,key,inverse):
+    # slicer key with the partition axis component indexing into the loaded shards
+    out = list(key)
+    i = j = 0
+    while i < len(key):
+      pair = key[i] is None and i+1 < len(key) and isinstance(key[i+1],numbers.Integral)
+      if j == self.axis:
+        if pair:
+          out[i+1] = 0
+        elif isinstance(key[i],slice):
+          out[i] = runslice(inverse)
+        else:
+          out[i] = inverse.reshape(np.shape(key[i]))
+        break
+      i += 2 if pair else 1
+      j += 1
+    return tuple(out)
+
+  def __call__(self,**kwargs):
+    return self[self.space.slicer(self.keys,**kwargs)]
+
+  def slice(self,**select):
+    return self[self.space.slicer(self.keys,**select)]
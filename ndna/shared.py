@@ -0,0 +1,186 @@
+r"""Zero-copy transport of Arrays between processes: SharedArray, Pool
+"""
+import io
+import pickle
+from concurrent.futures import Future,ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+from .space import Space,Array,SharedBlock
+
+# the Spaces known to this (worker) process, by position (see Pool)
+known = []
+
+class SharedArray():
+  r"""An ``Array`` held in shared memory, which pickles as a small handle.
+
+  Passing a SharedArray to a worker process (e.g. via ``concurrent.futures``)
+  sends only the block name, shape, dtype, space and keys; the worker then
+  rebuilds the ``array`` as a view of the same memory, without copying the data.
+
+  The creating process owns the block, and should :meth:`unlink` it when done,
+  e.g. by using the SharedArray as a context manager. Each process keeps the block
+  mapped for as long as this handle or any ``array`` view of it is alive.
+
+  Args:
+    arr (Array): the data to copy into a new shared memory block
+  """
+  def __init__(self,arr):
+    self.shape = arr.shape
+    self.dtype = arr.dtype
+    self.space = arr.space
+    self.keys  = arr.keys
+    self.shm   = SharedMemory(create=True,size=max(arr.nbytes,1))
+    self.name  = self.shm.name
+    self.owner = True
+    self.view  = None
+    np.copyto(self.buffer(),arr)
+
+  @classmethod
+  def attach(cls,name,shape,dtype,space,keys):
+    r"""Open an existing shared block by name, e.g. when unpickled in a worker."""
+    obj = cls.__new__(cls)
+    obj.shape = shape
+    obj.dtype = np.dtype(dtype)
+    obj.space = space
+    obj.keys  = keys
+    obj.shm   = SharedMemory(name=name)
+    obj.name  = name
+    obj.owner = False
+    obj.view  = None
+    return obj
+
+  def __reduce__(self):
+    return (SharedArray.attach,(self.name,self.shape,self.dtype.str,self.space,self.keys))
+
+  def __str__(self):
+    return '< SharedArray "{}" [{}] shape {} >'.format(
+      self.name,
+      ', '.join(str(key) for key in self.keys),
+      self.shape,
+    )
+
+  def __repr__(self):
+    return str(self)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self,*exc):
+    # views of the array remain usable: the block is unmapped once they are gone
+    if self.owner:
+      self.unlink()
+
+  def buffer(self):
+    # plain ndarray view of the shared block, whose base keeps the block mapped
+    size = int(np.prod(self.shape))
+    return np.asarray(SharedBlock(self.shm,size,self.dtype)).reshape(self.shape)
+
+  @property
+  def array(self):
+    r"""The data as an ``Array`` view of the shared block (writes are seen by all processes)."""
+    if self.view is None:
+      self.view = self.buffer().view(Array)
+      self.view.space = self.space
+      self.view.keys  = self.keys
+    return self.view
+
+  def close(self):
+    r"""Drop this handle's references to the block, which is unmapped once no ``array`` views remain."""
+    self.view = None
+    self.shm  = None
+
+  def unlink(self):
+    r"""Free the shared block by name (owner only, before :meth:`close`); existing mappings stay valid."""
+    self.shm.unlink()
+
+def share(arr):
+  r"""Copy an Array into shared memory, for zero-copy hand-off to worker processes.
+
+  Args:
+    arr (Array): the array to share
+
+  Returns:
+    (SharedArray): the shared handle; use ``.array`` to access the data
+  """
+  return SharedArray(arr)
+
+class SpacePickler(pickle.Pickler):
+  # pickles the Spaces in refs = {space: position} by position only
+  def __init__(self,file,refs):
+    super(SpacePickler,self).__init__(file,pickle.HIGHEST_PROTOCOL)
+    self.refs = refs
+
+  def persistent_id(self,obj):
+    return self.refs.get(obj) if isinstance(obj,Space) else None
+
+class SpaceUnpickler(pickle.Unpickler):
+  # finds the Spaces pickled by position in spaces
+  def __init__(self,file,spaces):
+    super(SpaceUnpickler,self).__init__(file)
+    self.spaces = spaces
+
+  def persistent_load(self,pid):
+    return self.spaces[pid]
+
+def dumps(obj,refs):
+  f = io.BytesIO()
+  SpacePickler(f,refs).dump(obj)
+  return f.getvalue()
+
+def loads(payload,spaces):
+  return SpaceUnpickler(io.BytesIO(payload),spaces).load()
+
+def preload(spaces):
+  # Pool worker initializer: keep the (interned) spaces, received once per process
+  known[:] = spaces
+
+def runtask(payload):
+  # Pool worker: run a pickled call, pickling the result with the same references
+  fn,args,kwargs = loads(payload,known)
+  return dumps(fn(*args,**kwargs),{space:i for i,space in enumerate(known)})
+
+class Pool():
+  r"""A process pool whose workers receive the given Spaces once, when they start.
+
+  Pickling an Array includes its whole Space (see ``Array.__reduce__``), so with a plain
+  ``ProcessPoolExecutor`` the dimensions are sent again with every task and result.
+  Through a Pool, arguments and results on any of **spaces** (or structurally equal ones)
+  refer to their Space by position only; other Spaces are pickled in full as usual.
+
+  Args:
+    spaces (list): the Spaces to send to each worker
+    workers (int): number of processes (default: as ``ProcessPoolExecutor``)
+
+  Example:
+    >>> with Pool([space],workers=4) as pool:
+    ...   results = list(pool.map(model,arrays))
+  """
+  def __init__(self,spaces,workers=None):
+    self.spaces = list(spaces)
+    self.refs = {space:i for i,space in enumerate(self.spaces)}
+    self.executor = ProcessPoolExecutor(workers,initializer=preload,initargs=(self.spaces,))
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self,*exc):
+    self.shutdown()
+
+  def submit(self,fn,*args,**kwargs):
+    r"""Schedule ``fn(*args,**kwargs)`` in a worker, as ``ProcessPoolExecutor.submit``."""
+    future = Future()
+    def done(inner):
+      try:
+        future.set_result(loads(inner.result(),self.spaces))
+      except BaseException as exc:
+        future.set_exception(exc)
+    self.executor.submit(runtask,dumps((fn,args,kwargs),self.refs)).add_done_callback(done)
+    return future
+
+  def map(self,fn,*iterables):
+    r"""Return an iterator of ``fn(*items)`` for each zipped items of **iterables**, in order."""
+    futures = [self.submit(fn,*items) for items in zip(*iterables)]
+    return (future.result() for future in futures)
+
+  def shutdown(self,wait=True):
+    self.executor.shutdown(wait)
@@ -1,26 +1,166 @@
 r"""Core classes of the NDNA package: Dimension, Space, and Array
 """
 from itertools import product
+from concurrent.futures import ThreadPoolExecutor,ProcessPoolExecutor
+import numbers
+import weakref
+import contextvars
 import numpy as np
 from . import utils
 
 # TODO: decorator & framework for dimension slicing
 
-def broadcast_keys(fun):
-  def decorator(arr1,arr2,**kwargs):
-    result = fun(arr1,arr2,**kwargs)
-    try:
-      result.keys = utils.unique(arr1.keys+arr2.keys)
-    except:
-      pass
-    return result
+# builds deferred expressions from ufunc calls while ndna.lazy.deferred() is active (per thread / context)
+deferral = contextvars.ContextVar('deferral',default=None)
+
+# runs large ufunc calls and reductions in chunks on a thread pool while ndna.parallel.threaded() is active
+# (per thread / context)
+threads = contextvars.ContextVar('threads',default=None)
+
+# called as changed(arr,select) after Array.update / updatemany / updatetable while ndna.derived tracks arr
+changed = None
+
+# number of rows shown by the repr of large Arrays
+REPRROWS = 10
+
+# shared Space objects by structure (see intern)
+registry = weakref.WeakValueDictionary()
+
+def intern(space):
+  # the shared Space structurally equal to space: the first such Space still alive
+  return registry.setdefault(space.signature,space)
+
+def restore(dims,cachesize):
+  # unpickled Spaces collapse into the shared equivalent, found by structure
+  space = registry.get(tuple(dim.signature for dim in dims))
+  return intern(Space(dims,cachesize)) if space is None else space
+
+def rebuild(arr,space,keys):
+  # unpickle an Array from its plain ndarray data
+  obj = arr.view(Array)
+  obj.space = space
+  obj.keys  = keys
+  return obj
+
+def rebroadcast(base,shape,space,keys):
+  # unpickle a broadcast Array as a read-only view of its (small) base
+  obj = np.broadcast_to(base,shape).view(Array)
+  obj.space = space
+  obj.keys  = keys
+  return obj
+
+def named_axes(fun):
+  def decorator(arr,axis=None,**kwargs):
+    return fun(arr,arr.axes(axis),**kwargs)
   return decorator
 
+def positions(key,shape):
+  r"""Convert a slicer (see ``Space.slicer``) into one array of positions per axis.
+
+  Args:
+    key (tuple): a slicer in the fast form ``(None, i, slice(None), ...)``,
+      or a tuple of (open mesh) index arrays or slices, one per axis
+    shape (tuple): the shape of the array being sliced
+
+  Returns:
+    (list): an integer array of selected positions for each axis
+  """
+  out = []
+  i = 0
+  while i < len(key):
+    k = key[i]
+    n = shape[len(out)]
+    if k is None and i+1 < len(key) and isinstance(key[i+1],numbers.Integral):
+      out.append(np.array([key[i+1]],dtype=np.intp))
+      i += 2
+      continue
+    if isinstance(k,slice):
+      out.append(np.arange(n)[k])
+    else:
+      out.append(np.asarray(k,dtype=np.intp).ravel())
+    i += 1
+  for n in shape[len(out):]:
+    out.append(np.arange(n))
+  return out
+
+def runslice(pos):
+  # a basic slice equivalent to the positions pos if they are evenly spaced, else pos
+  if len(pos) == 0:
+    return slice(0,0)
+  if len(pos) == 1:
+    return slice(int(pos[0]),int(pos[0])+1)
+  step = int(pos[1]-pos[0])
+  if step != 0 and np.all(np.diff(pos) == step):
+    stop = int(pos[-1])+step
+    return slice(int(pos[0]),stop if stop >= 0 else None,step)
+  return pos
+
+def labelblock(dims,start,stop,form='label'):
+  # columns of positions (form = 'index') or labels for combinations start:stop of dims
+  shape = tuple(len(dim) for dim in dims)
+  columns = np.unravel_index(np.arange(start,stop),shape) if shape else ()
+  if form != 'index':
+    columns = tuple(dim.array[col] for dim,col in zip(dims,columns))
+  return columns
+
+def mapblock(fn,dims,keys,start,stop,blocks):
+  # evaluate fn for combinations start:stop of dims, per block or per cell
+  columns = labelblock(dims,start,stop)
+  if blocks:
+    return fn(**dict(zip(keys,columns)))
+  cells = zip(*(col.tolist() for col in columns)) if columns else [()]*(stop-start)
+  return [fn(**dict(zip(keys,values))) for values in cells]
+
+def mapshared(name,size,dtype,fn,dims,keys,start,stop,blocks):
+  # process pool worker: write the mapblock result straight into shared memory
+  from multiprocessing.shared_memory import SharedMemory
+  shm = SharedMemory(name=name)
+  try:
+    out = np.ndarray((size,),dtype=dtype,buffer=shm.buf)
+    out[start:stop] = mapblock(fn,dims,keys,start,stop,blocks)
+    del out
+  finally:
+    shm.close()
+
+class SharedBlock():
+  # numpy array interface to a shared memory block, which stays mapped while any view of it is alive
+  def __init__(self,shm,size,dtype):
+    self.shm = shm
+    address = np.frombuffer(shm.buf,dtype=dtype,count=size).ctypes.data
+    self.__array_interface__ = {'shape':(size,),'typestr':np.dtype(dtype).str,'data':(address,False),'version':3}
+
 class Dimension():
+  __slots__ = ('name','key','values','lookup','array','ordered','signature','hash')
+
   def __init__(self,name,key,values):
+    # values: the labels as given (immutable); array: the same as a read-only numpy array
+    self.values = tuple(values)
     self.name   = name
     self.key    = key
-    self.values = list(values)
+    # duplicate values are found at their first position (as by list.index)
+    self.lookup = {}
+    for i,v in enumerate(self.values):
+      self.lookup.setdefault(v,i)
+    if all(np.ndim(v) == 0 for v in self.values):
+      self.array = np.array(self.values)
+    else:
+      # tuple (or other sequence) labels: one object per value, not extra axes
+      self.array = np.empty(len(self.values),dtype=object)
+      self.array[:] = self.values
+    self.array.flags.writeable = False
+    self.ordered = np.issubdtype(self.array.dtype,np.number) and bool(np.all(np.diff(self.array) > 0))
+    self.signature = (name,key,self.array.dtype.str,self.values)
+    self.hash = hash(self.signature)
+
+  def __eq__(self,other):
+    return self is other or (isinstance(other,Dimension) and self.hash == other.hash
+                             and self.signature == other.signature)
+
+  def __hash__(self):
+    return self.hash
+
+  def __reduce__(self):
+    return (Dimension,(self.name,self.key,self.values))
 
   def __str__(self):
     return '< Dimension "{}" ({}): [{}] >'.format(
@@ -36,16 +176,67 @@ class Dimension():
     )
 
   def __len__(self):
-    return len(self.values)
+    return len(self.array)
+
+  def index(self,value):
+    try:
+      return self.lookup[value]
+    except (KeyError,TypeError):
+      raise ValueError('{!r} is not in list of values for dimension "{}" ({})'.format(
+        value, self.name, self.key,
+      )) from None
+
+  def range(self,select):
+    # positions (as a slice) of the values from select.start to select.stop inclusive,
+    # found by binary search; select.step is a step in positions
+    if not self.ordered:
+      raise ValueError('Range selection requires ordered numeric values: dimension "{}" ({})'.format(
+        self.name, self.key,
+      ))
+    lo = 0 if select.start is None else int(np.searchsorted(self.array,select.start,'left'))
+    hi = len(self) if select.stop is None else int(np.searchsorted(self.array,select.stop,'right'))
+    return slice(lo,hi,select.step)
+
+  def indices(self,values):
+    if isinstance(values,slice):
+      return np.arange(len(self))[self.range(values)]
+    if isinstance(values,np.ndarray):
+      # encode the unique labels only, then broadcast back via the inverse
+      uvalues,inverse = np.unique(values.ravel(),return_inverse=True)
+      codes = np.array([self.index(v) for v in uvalues.tolist()],dtype=np.intp)
+      return codes[inverse].reshape(values.shape)
+    return np.array([self.index(v) for v in utils.flatten(values)],dtype=np.intp)
 
 class Space():
-  def __init__(self,dims):
-    self.dims  = list(dims)
-    self.ndim  = len(dims)
-    self.shape = tuple(len(dim.values) for dim in dims)
-    self.keys  = tuple(dim.key for dim in dims)
-    self.index = {dim.key:i for i,dim in enumerate(dims)}
-    self.dim   = {dim.key:dim for dim in dims}
+  __slots__ = ('dims','ndim','shape','keys','index','dim','cache','plans','signature','hash','__weakref__')
+
+  def __init__(self,dims,cachesize=256):
+    self.dims  = tuple(dims)
+    self.ndim  = len(self.dims)
+    self.shape = tuple(len(dim) for dim in self.dims)
+    self.keys  = tuple(dim.key for dim in self.dims)
+    self.index = {dim.key:i for i,dim in enumerate(self.dims)}
+    self.dim   = {dim.key:dim for dim in self.dims}
+    self.cache = utils.LRUCache(cachesize)
+    self.plans = utils.LRUCache(cachesize)
+    # structural identity: equal dimensions in the same order (caches are not compared)
+    self.signature = tuple(dim.signature for dim in self.dims)
+    self.hash = hash(self.signature)
+    registry.setdefault(self.signature,self)
+
+  def __eq__(self,other):
+    return self is other or (isinstance(other,Space) and self.hash == other.hash
+                             and self.signature == other.signature)
+
+  def __hash__(self):
+    return self.hash
+
+  def __reduce__(self):
+    return (restore,(self.dims,self.cache.maxsize))
+
+  def __deepcopy__(self,memo):
+    # an independent (not interned) copy, with empty caches
+    return Space(self.dims,self.cache.maxsize)
 
   def __str__(self):
     return '< Space [\n  {}] >'.format(
@@ -74,49 +265,234 @@ class Space():
     for values in product(*[dim.values for dim in sdims]):
       yield dict(zip(skeys,values))
 
+  def iterblocks(self,keys=None,size=65536,form='label'):
+    # like iter, but yielding blocks of up to size combinations as columns:
+    # form = 'index' (int positions), 'label' (values), or 'record' (structured array)
+    if form not in ('index','label','record'):
+      raise ValueError('Unknown block form: "{}"'.format(form))
+    sdims = self.dims if keys is None else self.keyfilter(self.dims,keys)
+    skeys = self.keys if keys is None else self.keyfilter(self.keys,keys)
+    total = int(np.prod([len(dim) for dim in sdims]))
+    for start in range(0,total,size):
+      stop = min(start+size,total)
+      columns = labelblock(sdims,start,stop,form)
+      if form == 'record':
+        block = np.empty(stop-start,dtype=[(key,col.dtype) for key,col in zip(skeys,columns)])
+        for key,col in zip(skeys,columns):
+          block[key] = col
+        yield block
+      else:
+        yield dict(zip(skeys,columns))
+
+  def map(self,fn,keys=None,executor=None,chunksize=4096,blocks=False,dtype=float,workers=None):
+    # evaluate fn over the subspace of keys into a new Array:
+    # blocks = False: fn(**cell) per combination; True: fn(**columns) per block of labels
+    # executor = None (serial), 'thread', 'process', or a concurrent.futures executor
+    sdims = self.dims if keys is None else self.keyfilter(self.dims,keys)
+    skeys = self.keys if keys is None else self.keyfilter(self.keys,keys)
+    total = int(np.prod([len(dim) for dim in sdims]))
+    ranges = [(start,min(start+chunksize,total)) for start in range(0,total,chunksize)]
+    dtype = np.dtype(dtype)
+    if executor is None:
+      out = np.empty(total,dtype=dtype)
+      for start,stop in ranges:
+        out[start:stop] = mapblock(fn,sdims,skeys,start,stop,blocks)
+      return Array(out,self,list(skeys))
+    pool = executor
+    if isinstance(executor,str):
+      pools = {'thread':ThreadPoolExecutor,'process':ProcessPoolExecutor}
+      if executor not in pools:
+        raise ValueError('Unknown executor: "{}"'.format(executor))
+      pool = pools[executor](workers)
+    try:
+      if isinstance(pool,ProcessPoolExecutor):
+        # workers write into shared memory, so results are not pickled back,
+        # and the result is a view of the (unlinked) block, so it is not copied either
+        from multiprocessing.shared_memory import SharedMemory
+        shm = SharedMemory(create=True,size=max(total*dtype.itemsize,1))
+        try:
+          futures = [pool.submit(mapshared,shm.name,total,dtype.str,fn,sdims,skeys,start,stop,blocks)
+                     for start,stop in ranges]
+          for future in futures:
+            future.result()
+        finally:
+          shm.unlink()
+        out = np.asarray(SharedBlock(shm,total,dtype))
+      else:
+        out = np.empty(total,dtype=dtype)
+        def task(start,stop):
+          out[start:stop] = mapblock(fn,sdims,skeys,start,stop,blocks)
+        for future in [pool.submit(task,start,stop) for start,stop in ranges]:
+          future.result()
+    finally:
+      if pool is not executor:
+        pool.shutdown()
+    return Array(out,self,list(skeys))
+
   def coords(self,keys=None):
+    # 'label,label,...' per cell, each label padded to the longest of its dimension
     sdims = self.dims if keys is None else self.keyfilter(self.dims,keys)
     shape = self.shape if keys is None else self.subshape(keys)
-    lens = list(map(lambda dim: max(map(lambda v: len(str(v)),dim.values)),sdims))
-    return np.reshape([
-      ','.join([str(v).ljust(l) for v,l in zip(values,lens)])
-      for values in product(*map(lambda dim: dim.values, sdims))
-    ],shape)
+    total = int(np.prod([len(dim) for dim in sdims]))
+    text = None
+    for dim,code in zip(sdims,labelblock(sdims,0,total,form='index')):
+      labels = np.array([str(v) for v in dim.values])
+      labels = np.char.ljust(labels,int(np.char.str_len(labels).max()))[code]
+      text = labels if text is None else np.char.add(np.char.add(text,','),labels)
+    return np.reshape(np.full(total,'') if text is None else text,shape)
 
   def subshape(self,keys):
     return tuple(self.keysub(self.shape,1,keys))
 
   def slicer(self,keys=None,**kwargs):
+    # compiled slicers are cached by (keys, selection)
+    try:
+      ckey = (None if keys is None else tuple(keys), utils.freeze(kwargs))
+      hash(ckey)
+    except TypeError:
+      return self.compile(keys,**kwargs)
+    return self.cache.fetch(ckey,lambda: self.compile(keys,**kwargs))
+
+  def compile(self,keys=None,**kwargs):
     # TODO: assert all kwargs in self.keys
     slicer = []
-    if bool(kwargs) and max(map(utils.olen,kwargs.values())) > 1:
-      # selecting multiple indexes in at least one dimension: slow method
-      for i,key in enumerate(self.keys):
-        if key in kwargs:
-          slicer.append([self.dims[i].values.index(v) for v in utils.flatten(kwargs[key])])
-        elif (keys is None) or (key in keys):
-          slicer.append(range(0,self.shape[i]))
-        else:
-          slicer.append([0])
-      return np.ix_(*slicer)
-    else:
-      # selecting no more than one index per dimension: fast method
+    single = lambda v: isinstance(v,str) or not (isinstance(v,slice) or hasattr(v,'__iter__'))
+    if all(map(single,kwargs.values())):
+      # selecting one value per dimension: fast method
       for i,key in enumerate(self.keys):
         if key in kwargs:
-          slicer.extend((None,self.dims[i].values.index(kwargs[key])))
-          # TODO: what if kwargs[key] is a list with len = 1
+          slicer.extend((None,self.dims[i].index(kwargs[key])))
         else:
           slicer.append(slice(None))
       return tuple(slicer)
+    # selecting ranges or multiple values: basic slices (views) for evenly spaced positions
+    for i,key in enumerate(self.keys):
+      if key not in kwargs:
+        slicer.append(slice(None) if (keys is None) or (key in keys) else slice(0,1))
+      elif isinstance(kwargs[key],slice):
+        slicer.append(self.dims[i].range(kwargs[key]))
+      else:
+        slicer.append(runslice(self.dims[i].indices(kwargs[key])))
+    if sum(not isinstance(item,slice) for item in slicer) <= 1:
+      # no more than one index array: numpy keeps the selection orthogonal
+      return tuple(slicer)
+    return np.ix_(*[np.arange(n)[item] if isinstance(item,slice) else item
+                    for item,n in zip(slicer,self.shape)])
+
+  def substitute(self,dim):
+    # new space with the dimension of the same key replaced by dim
+    return Space([dim if d.key == dim.key else d for d in self.dims],self.cache.maxsize)
+
+  def reindexer(self,source,keys):
+    # (flat indices into canonical data of source spanning keys, mask of cells to fill or None)
+    # mapping onto self by dimension key and value label; cached per (source, keys)
+    def plan():
+      # source positions of the labels of self, along the target axis of each source key
+      mesh = lambda p,i: p.reshape(tuple(-1 if a == i else 1 for a in range(self.ndim)))
+      pos = {key: mesh(np.array([source.dim[key].lookup.get(v,-1) for v in self.dim[key].values],
+                                dtype=np.intp),self.index[key]) for key in keys}
+      flat = np.ravel_multi_index([np.maximum(pos[key],0) if key in pos else np.zeros((1,)*self.ndim,dtype=np.intp)
+                                   for key in source.keys],source.subshape(keys))
+      missing = [p < 0 for p in pos.values() if np.any(p < 0)]
+      mask = np.broadcast_to(np.logical_or.reduce(np.broadcast_arrays(*missing)),flat.shape) if missing else None
+      return np.broadcast_to(flat,self.subshape(keys)),mask
+    return self.plans.fetch(('reindex',source,tuple(keys)),plan)
+
+  def flatindex(self,shape,keys=None,**kwargs):
+    # flat (C-order) indices of a selection within a canonical array of shape
+    def plan():
+      return np.ravel_multi_index(np.ix_(*positions(self.slicer(keys,**kwargs),shape)),shape)
+    try:
+      ckey = ('flat',shape,None if keys is None else tuple(keys),utils.freeze(kwargs))
+      hash(ckey)
+    except TypeError:
+      return plan()
+    return self.plans.fetch(ckey,plan)
+
+  def layout(self,arr):
+    # the keys spanned by the axes of arr: None = all space.keys (canonical);
+    # full-rank arrays are canonical only if their keys are in space order
+    if arr.ndim == len(arr.keys) and (arr.ndim != self.ndim or tuple(arr.keys) != self.keys):
+      return tuple(arr.keys)
+    if arr.ndim == self.ndim:
+      return None
+    raise ValueError('Cannot align array with {} axes to keys {}'.format(arr.ndim,list(arr.keys)))
+
+  def expander(self,layout):
+    # (transpose, indexer) mapping axes in layout order onto canonical axes
+    def plan():
+      for key in layout:
+        if key not in self.index:
+          raise ValueError('Key "{}" is not in space {}'.format(key,repr(self)))
+      perm = tuple(sorted(range(len(layout)),key=lambda a: self.index[layout[a]]))
+      indexer = tuple(slice(None) if key in layout else None for key in self.keys)
+      return (None if perm == tuple(range(len(perm))) else perm), indexer
+    return self.plans.fetch(('expand',layout),plan)
+
+  def expand(self,arr,layout):
+    # zero-copy canonical view of arr whose axes follow layout
+    if layout is None:
+      return arr
+    perm,indexer = self.expander(layout)
+    return (arr if perm is None else arr.transpose(perm))[indexer]
+
+  def collapse(self,arr,keys):
+    # view of canonical arr with its axes in keys order (the other axes must have length 1)
+    order = [key for key in self.keys if key in keys]
+    arr = arr.reshape(tuple(arr.shape[self.index[key]] for key in order))
+    perm = tuple(order.index(key) for key in keys)
+    return arr if perm == tuple(range(len(perm))) else arr.transpose(perm)
+
+  def broadcaster(self,descs):
+    # (expand?, merged keys) for operands described by (layout, keys)
+    def plan():
+      layouts = set(layout for layout,keys in descs)
+      if len(layouts) == 1 and None not in layouts:
+        return False,list(layouts.pop())
+      keys = set(key for layout,keys in descs for key in keys)
+      return True,[key for key in self.keys if key in keys]
+    return self.plans.fetch(('broadcast',descs),plan)
+
+  def align(self,*arrs):
+    # zero-copy views of arrs which broadcast by key name, plus the merged keys
+    layouts = [self.layout(arr) for arr in arrs]
+    expand,keys = self.broadcaster(tuple(
+      (layout,tuple(arr.keys)) for layout,arr in zip(layouts,arrs)))
+    if expand:
+      arrs = [self.expand(arr,layout) for arr,layout in zip(arrs,layouts)]
+    return tuple(arrs)+(list(keys),)
 
 class Array(np.ndarray):
-  def __new__(cls,arr,space,keys):
+  r"""A numpy array whose axes are named by the keys of the dimensions of a Space.
+
+  Args:
+    arr (float,array-like): the data, or a single value to fill the array with
+    space (Space): the space of the array
+    keys (list): the keys of the dimensions spanned by the array
+    broadcast (bool): hold a single value as a read-only, zero-copy broadcast view (O(1) memory)
+
+  Broadcast arrays cannot be written in place: :meth:`update`, :meth:`updatemany` and
+  :meth:`updatetable` raise ``ValueError`` on them. Call :meth:`materialize` first, which
+  returns a writable copy, e.g. ``X = X.materialize(); X.update(values,i='high')``.
+  """
+  def __new__(cls,arr,space,keys,broadcast=False):
     # if issubclass(type(arr),cls):
     #   cls = type(arr)
+    # broadcast: a single value is held as a read-only zero-copy view (keeping its dtype), which
+    # must be materialized before it is updated (see materialize)
     shape = space.subshape(keys)
+    if len(keys) == space.ndim and tuple(keys) != space.keys:
+      # the data is canonical, so full-rank keys are held in space order (see Space.layout)
+      keys = [key for key in space.keys if key in keys]
     obj = np.asanyarray(arr).view(cls)
-    if obj.size == 1:
-      obj = np.multiply(obj, np.ones(shape))
+    if obj.size == 1 and broadcast:
+      obj = np.broadcast_to(obj.view(np.ndarray).reshape(()),shape).view(cls)
+    elif obj.size == 1:
+      value = np.multiply(obj.view(np.ndarray).reshape(()), np.ones(()))
+      if value == 0:
+        obj = np.zeros(shape,dtype=value.dtype).view(cls)
+      else:
+        obj = np.full(shape,value,dtype=value.dtype).view(cls)
     elif obj.shape != shape:
       try:
         obj = obj.reshape(shape)
@@ -132,51 +508,312 @@ class Array(np.ndarray):
     self.space = getattr(obj,'space',None)
     self.keys  = getattr(obj,'keys',None)
 
-  @broadcast_keys
-  def __add__(self,arr):
-    return super(Array,self).__add__(arr)
-
-  @broadcast_keys
-  def __sub__(self,arr):
-    return super(Array,self).__sub__(arr)
-
-  @broadcast_keys
-  def __mul__(self,arr):
-    return super(Array,self).__mul__(arr)
+  def __repr__(self):
+    # large arrays: only a header and the first rows are formatted
+    if self.space is None or not self.keyed or self.size <= np.get_printoptions()['threshold'] \
+        or self.expand().shape != self.space.subshape(self.keys):
+      return super(Array,self).__repr__()
+    return 'Array[{}] shape {} {} ({} cells):\n  {}\n  ...'.format(
+      ','.join(key for key in self.space.keys if key in self.keys),
+      self.shape,
+      self.dtype,
+      self.size,
+      '\n  '.join(self.rows(0,REPRROWS)),
+    )
 
-  @broadcast_keys
-  def __truediv__(self,arr):
-    return super(Array,self).__truediv__(arr)
+  def __reduce__(self):
+    # pickle the space and keys with the data; the space is pickled by structure,
+    # once per pickle, and interned when unpickled (see Space.__reduce__);
+    # ndna.shared.Pool sends it to worker processes only once instead
+    if self.isbroadcast:
+      base = self.view(np.ndarray)[tuple(
+        slice(0,1) if stride == 0 else slice(None) for stride in self.strides)].copy()
+      return (rebroadcast,(base,self.shape,self.space,self.keys))
+    return (rebuild,(self.view(np.ndarray),self.space,self.keys))
 
   def __getitem__(self,key):
     if isinstance(key,dict):
       return self(**key)
-    return super(Array,self).__getitem__(key)
+    result = super(Array,self).__getitem__(key)
+    if isinstance(result,Array) and result.space is not None and (result.ndim < self.ndim or not result.keyed):
+      # positional indexing dropped axes: the keys no longer apply
+      return result.view(np.ndarray)
+    return result
 
   def __call__(self,**kwargs):
     return self[self.space.slicer(self.keys,**kwargs)]
 
-  # def __array_ufunc__(self,ufunc,method,*args,**kwargs):
-  #   return super(Array,self).__array_ufunc__(ufunc,method,*args,**kwargs)
+  def __array_ufunc__(self,ufunc,method,*inputs,out=None,**kwargs):
+    defer = deferral.get()
+    if defer is not None and method == '__call__' and out is None:
+      return defer(ufunc,inputs,kwargs)
+    # describe the keyed Array operands and plan their alignment by key
+    space,descs = None,[]
+    for arr in inputs+(out or ()):
+      if isinstance(arr,Array) and arr.keyed:
+        if space is None:
+          space = arr.space
+        elif arr.space is not space and arr.space != space:
+          raise ValueError('Cannot combine Arrays from different spaces')
+        descs.append((space.layout(arr),tuple(arr.keys)))
+    if space is None:
+      # bare views and positional slices without valid keys behave like np.ndarray
+      inputs = tuple(arr.view(np.ndarray) if isinstance(arr,Array) else arr for arr in inputs)
+      if out:
+        kwargs['out'] = tuple(arr.view(np.ndarray) if isinstance(arr,Array) else arr for arr in out)
+      return getattr(ufunc,method)(*inputs,**kwargs)
+    expand,keys = space.broadcaster(tuple(descs))
+    if method == 'reduce' and isinstance(inputs[0],Array) and inputs[0].keyed:
+      return inputs[0].reduce(ufunc,inputs[0],out,keys,**kwargs)
+    args = tuple(self.unwrap(arr,expand) for arr in inputs)
+    if out:
+      kwargs['out'] = tuple(self.unwrap(arr,expand) for arr in out)
+    pool = threads.get()
+    if pool is not None and method == '__call__':
+      result = pool.call(ufunc,args,kwargs)
+    else:
+      result = getattr(ufunc,method)(*args,**kwargs)
+    if method == 'at' or method == 'reduceat' or method == 'outer':
+      # no well-defined keys for these results
+      return result
+    if ufunc.nout == 1:
+      return self.wrap(result,out[0] if out else None,space,keys)
+    return tuple(self.wrap(res,arr,space,keys) for res,arr in zip(result,out or (None,)*ufunc.nout))
+
+  @property
+  def keyed(self):
+    # whether the keys describe the axes: canonical or compact layout
+    return self.space is not None and (self.ndim == self.space.ndim or self.ndim == len(self.keys))
+
+  def unwrap(self,arr,expand):
+    # plain ndarray view of arr, expanded to the canonical layout if needed
+    if not isinstance(arr,Array):
+      return arr
+    if expand and arr.keyed:
+      arr = arr.space.expand(arr,arr.space.layout(arr))
+    return arr.view(np.ndarray)
+
+  def wrap(self,result,out,space,keys):
+    # Array view of a ufunc result, or the original out argument
+    if out is not None:
+      return out
+    if not isinstance(result,np.ndarray):
+      return result
+    result = result.view(Array)
+    result.space = space
+    result.keys  = keys
+    return result
+
+  def reduce(self,ufunc,arr,out,keys,axis=0,keepdims=False,**kwargs):
+    # reduce in the canonical layout (keepdims), then drop the reduced keys
+    space  = self.space
+    layout = space.layout(arr)
+    axes = range(arr.ndim) if axis is None else utils.flatten(axis)
+    rkeys = set((space.keys if layout is None else layout)[a] for a in axes)
+    axes = tuple(space.index[key] for key in rkeys) if layout is not None else \
+           tuple(a % arr.ndim for a in axes)
+    keys = [key for key in keys if key not in rkeys]
+    if out:
+      kwargs['out'] = tuple(self.unwrap(self.unreduce(o,keys,keepdims,layout),True) for o in out)
+    pool = threads.get()
+    if pool is not None:
+      result = pool.reduce(ufunc,self.unwrap(arr,True),axes,kwargs)
+    else:
+      result = ufunc.reduce(self.unwrap(arr,True),axis=axes,keepdims=True,**kwargs)
+    if out:
+      return out[0]
+    if not keepdims:
+      result = space.collapse(result,keys)
+      if not result.ndim:
+        return result[()]
+    elif layout is not None:
+      # keepdims: the axes of arr, with the reduced ones of length 1
+      keys = list(layout)
+      result = space.collapse(result,keys)
+    return self.wrap(result,None,space,keys)
+
+  def unreduce(self,out,keys,keepdims,layout):
+    # view of a reduction output argument with the canonical keepdims shape
+    if isinstance(out,Array):
+      return out.expand()
+    return self.space.expand(out,layout if keepdims else tuple(keys))
+
+  def axes(self,axis):
+    # axis numbers for any key names in axis
+    if axis is None or self.space is None:
+      return axis
+    layout = self.space.layout(self) or self.space.keys
+    def index(a):
+      if isinstance(a,str):
+        if a not in layout:
+          raise ValueError('Key "{}" is not an axis of this Array'.format(a))
+        return layout.index(a)
+      return a
+    if isinstance(axis,(str,int,np.integer)):
+      return index(axis)
+    return tuple(index(a) for a in axis)
+
+  @named_axes
+  def sum(self,axis=None,**kwargs):
+    return super(Array,self).sum(axis,**kwargs)
+
+  @named_axes
+  def prod(self,axis=None,**kwargs):
+    return super(Array,self).prod(axis,**kwargs)
+
+  @named_axes
+  def mean(self,axis=None,**kwargs):
+    return super(Array,self).mean(axis,**kwargs)
+
+  @named_axes
+  def std(self,axis=None,**kwargs):
+    return super(Array,self).std(axis,**kwargs)
+
+  @named_axes
+  def var(self,axis=None,**kwargs):
+    return super(Array,self).var(axis,**kwargs)
+
+  @named_axes
+  def min(self,axis=None,**kwargs):
+    return super(Array,self).min(axis,**kwargs)
+
+  @named_axes
+  def max(self,axis=None,**kwargs):
+    return super(Array,self).max(axis,**kwargs)
+
+  def average(self,axis=None,weights=None,keepdims=False):
+    if weights is None:
+      return self.mean(axis,keepdims=keepdims)
+    if isinstance(weights,Array):
+      arr,weights,keys = self.space.align(self,weights)
+      # broadcast (zero-copy) so the denominator counts every summed cell
+      weights = np.broadcast_to(weights,np.broadcast_shapes(arr.shape,weights.shape),subok=True)
+      weights.keys = keys
+    else:
+      arr = self
+      weights = np.broadcast_to(weights,self.shape,subok=True)
+    return (arr*weights).sum(axis,keepdims=keepdims) / weights.sum(axis,keepdims=keepdims)
+
+  def group(self,key,groups,ufunc=np.add):
+    # aggregate the values of dimension key into groups with one ufunc.reduceat pass
+    space = self.space
+    def plan():
+      dim = space.dim[key]
+      if callable(groups):
+        gvalues = utils.odict()
+        for v in dim.values:
+          gvalues.setdefault(groups(v),[]).append(v)
+      else:
+        gvalues = groups
+      positions = [dim.indices(values) for values in gvalues.values()]
+      if not all(len(p) for p in positions):
+        raise ValueError('Groups must each contain at least one value')
+      order = np.concatenate(positions)
+      offsets = np.cumsum([0]+[len(p) for p in positions[:-1]])
+      if np.array_equal(order,np.arange(len(dim))):
+        order = None
+      labels = tuple(gvalues.keys())
+      gspace = space.plans.fetch(('substitute',key,labels),
+        lambda: space.substitute(Dimension(dim.name,key,labels)))
+      return order,offsets,gspace
+    gkey = groups if callable(groups) else \
+      tuple((label,utils.freeze(values)) for label,values in groups.items())
+    order,offsets,gspace = space.plans.fetch(('group',key,gkey),plan)
+    if key not in self.keys:
+      raise ValueError('Key "{}" is not an axis of this Array'.format(key))
+    axis = self.axes(key)
+    arr = self.view(np.ndarray)
+    if order is not None:
+      arr = np.take(arr,order,axis=axis)
+    result = ufunc.reduceat(arr,offsets,axis=axis).view(Array)
+    result.space = gspace
+    result.keys  = list(self.keys)
+    return result
+
+  def expand(self):
+    return self.space.expand(self,self.space.layout(self))
+
+  def compact(self):
+    if len(self.keys) == self.ndim:
+      return self
+    obj = self.reshape(tuple(n for n,key in zip(self.shape,self.space.keys) if key in self.keys))
+    obj.keys = [key for key in self.space.keys if key in self.keys]
+    return obj
+
+  def reindex(self,space,fill=np.nan):
+    # this array on another space, matching dimensions by key and values by label:
+    # one take via cached index maps (see Space.reindexer); labels not in self.space get fill
+    if space == self.space:
+      return self
+    target = self.expand()
+    keys = [key for key in self.space.keys if key in self.keys]
+    if target.shape != self.space.subshape(keys):
+      raise ValueError('Cannot reindex a sliced Array: shape {} vs space shape {}'.format(
+        target.shape,self.space.subshape(keys)))
+    for key in keys:
+      if key not in space.index:
+        raise ValueError('Key "{}" is not in space {}'.format(key,repr(space)))
+    flat,mask = space.reindexer(self.space,tuple(keys))
+    out = np.ravel(target.view(np.ndarray)).take(flat)
+    if mask is not None:
+      out = out.astype(np.result_type(out,fill),copy=False)
+      out[mask] = fill
+    return Array(out,space,list(self.keys))
+
+  def labels(self,key,sep=','):
+    # text labels of dimension key, quoted (as CSV) if they contain sep, quotes or newlines
+    def plan():
+      quote = lambda v: '"'+v.replace('"','""')+'"' if any(c in v for c in (sep,'"','\n','\r')) else v
+      return np.array([quote(str(v)) for v in self.space.dim[key].values])
+    return self.space.plans.fetch(('labels',key,sep),plan)
+
+  def rows(self,start=0,stop=None,sep=',',fmt=None):
+    # long-format text rows 'labels<sep>value' of cells start:stop (C order, keys in space order),
+    # formatted per column by numpy: fmt = None (shortest repr) or a printf format, e.g. '%.3f'
+    target = self.expand()
+    keys = [key for key in self.space.keys if key in self.keys]
+    if target.shape != self.space.subshape(keys):
+      raise ValueError('Cannot label the cells of a sliced Array: shape {} vs space shape {}'.format(
+        target.shape,self.space.subshape(keys)))
+    stop = target.size if stop is None else min(stop,target.size)
+    values = target.view(np.ndarray).flat[start:stop]
+    text = values.astype(str) if fmt is None else np.char.mod(fmt,values)
+    codes = labelblock([self.space.dim[key] for key in keys],start,stop,form='index')
+    for key,code in reversed(list(zip(keys,codes))):
+      text = np.char.add(np.char.add(self.labels(key,sep)[code],sep),text)
+    return text
 
   def coords(self):
-    strfun = lambda x: str(float(x))
-    prefun = lambda s: s.find('.')
-    decfun = lambda s: len(s)-s.find('.')-1
-    sarr = list(map(strfun,self.flatten()))
-    spre = max(map(prefun,sarr))
-    sdec = max(map(decfun,sarr))
-    fmt  = '{{:{}.{}f}}'.format(spre+1+sdec,sdec)
-    def fmtfun(key,value):
-      return key+': '+fmt.format(value)
-    return np.reshape([
-      fmtfun(k,v) for k,v in zip(self.space.coords(self.keys).flatten(),self.flatten())
-    ],self.shape)
+    # 'labels: value' per cell, values in fixed point with aligned decimal points
+    values = np.asarray(self).ravel()
+    text = values.astype(float).astype(str)
+    point = np.char.find(text,'.')
+    spre = int(point.max())
+    sdec = int((np.char.str_len(text)-point-1).max())
+    text = np.char.mod('%{}.{}f'.format(spre+1+sdec,sdec),values)
+    return np.reshape(np.char.add(np.char.add(self.space.coords(self.keys).ravel(),': '),text),self.shape)
 
   def slice(self,**select):
     return self[self.space.slicer(self.keys,**select)]
 
+  @property
+  def isbroadcast(self):
+    # whether this is a read-only broadcast view, e.g. from Array(value,...,broadcast=True)
+    return not self.flags.writeable and any(stride == 0 for stride in self.strides)
+
+  def materialize(self):
+    # a writable Array with the same data: self, or a full copy if self is broadcast
+    if self.isbroadcast:
+      return self.copy()
+    return self
+
+  def checkwritable(self):
+    # broadcast Arrays are read-only views which cannot be updated in place
+    if self.isbroadcast:
+      raise ValueError('Cannot update a broadcast Array in place: use X = X.materialize() first')
+
   def update(self,arr,**select):
+    self.checkwritable()
     if not isinstance(arr,np.ndarray):
       arr = np.array(arr)
     if select:
@@ -185,4 +822,96 @@ class Array(np.ndarray):
       self[slicer] = arr.reshape(shape)
     else:
       np.copyto(self,arr.reshape(self.shape))
+    if changed is not None:
+      changed(self,select)
+    return self
+
+  def updatemany(self,pairs,accumulate=False):
+    # apply many (select, arr) updates in one scatter; accumulate: sum overlapping targets
+    self.checkwritable()
+    target = self.expand()
+    flats,values,selects = [],[],[]
+    for select,arr in pairs:
+      selects.append(select)
+      flat = self.space.flatindex(target.shape,self.keys,**select)
+      flats.append(flat.ravel())
+      arr = np.asarray(arr)
+      values.append((np.broadcast_to(arr,flat.shape) if arr.size == 1 else arr.reshape(flat.shape)).ravel())
+    if flats:
+      self.scatter(target,np.concatenate(flats),np.concatenate(values),accumulate)
+    if changed is not None:
+      for select in selects:
+        changed(self,select)
+    return self
+
+  def updatetable(self,columns,values,accumulate=False):
+    # apply long-format updates: columns = {key: labels}, one target cell per row
+    self.checkwritable()
+    target,flat = self.tableindex(columns)
+    self.scatter(target,flat,np.broadcast_to(values,flat.shape),accumulate)
+    if changed is not None:
+      changed(self,{key: np.unique(columns[key]) for key in columns if key in self.space.index})
     return self
+
+  def tableindex(self,columns):
+    # canonical view of self and flat indices of the cells labelled by columns = {key: labels}
+    target = self.expand()
+    coords = []
+    for key,n in zip(self.space.keys,target.shape):
+      if key in columns:
+        coords.append(self.space.dim[key].indices(np.asarray(columns[key])).ravel())
+      elif n == 1:
+        coords.append(0)
+      else:
+        raise ValueError('Missing column for key "{}"'.format(key))
+    return target,np.asarray(np.ravel_multi_index(np.broadcast_arrays(*coords),target.shape))
+
+  @classmethod
+  def fromrecords(cls,records,space,keys=None,value='value',duplicates='error',missing=0,dtype=None):
+    # new Array from long-format records, encoded and scattered in one vectorized pass:
+    # records = {column: values}, a structured array, a list of dicts,
+    # or a list of tuples (keys..., value); keys default to the key columns, in space order
+    # duplicates = 'sum', 'last', or 'error'; missing = fill value, or 'error'
+    if duplicates not in ('sum','last','error'):
+      raise ValueError('Unknown duplicates policy: "{}"'.format(duplicates))
+    if isinstance(records,np.ndarray) and records.dtype.names:
+      columns = {name:records[name] for name in records.dtype.names}
+    elif isinstance(records,dict):
+      columns = records
+    else:
+      records = list(records)
+      if records and isinstance(records[0],dict):
+        columns = {name:[record[name] for record in records] for name in records[0]}
+      else:
+        if keys is None:
+          raise ValueError('keys are required for records given as tuples')
+        rows = list(zip(*records)) if records else [()]*(len(keys)+1)
+        columns = dict(zip(list(keys)+[value],rows))
+    if value not in columns:
+      raise ValueError('Missing value column "{}"'.format(value))
+    if keys is None:
+      keys = [key for key in space.keys if key in columns]
+    values = np.asarray(columns[value])
+    if dtype is None:
+      dtype = values.dtype if missing == 'error' else np.result_type(values,np.asarray(missing))
+    obj = cls(np.full(space.subshape(keys),0 if missing == 'error' else missing,dtype=dtype),space,list(keys))
+    target,flat = obj.tableindex(columns)
+    if duplicates == 'error' or missing == 'error':
+      counts = np.bincount(flat,minlength=target.size)
+      label = lambda mask: {key: space.dim[key].values[i] for key,i in zip(space.keys,
+        np.unravel_index(int(np.argmax(mask)),target.shape)) if key in keys}
+      if duplicates == 'error' and np.any(counts > 1):
+        raise ValueError('Duplicate records for {} cells, e.g. {}'.format(
+          int(np.sum(counts > 1)),label(counts > 1)))
+      if missing == 'error' and np.any(counts == 0):
+        raise ValueError('No records for {} cells, e.g. {}'.format(
+          int(np.sum(counts == 0)),label(counts == 0)))
+    obj.scatter(target,flat,np.broadcast_to(values,flat.shape),duplicates == 'sum')
+    return obj
+
+  def scatter(self,target,flat,values,accumulate):
+    # write values at the flat indices of target (a canonical view of self)
+    if accumulate:
+      np.add.at(target.view(np.ndarray),np.unravel_index(flat,target.shape),values)
+    else:
+      target.view(np.ndarray).put(flat,values)
@@ -0,0 +1,215 @@
+r"""Sparse storage for Arrays over large product spaces: SparseArray
+"""
+import numpy as np
+from .space import Array,positions
+
+class SparseArray():
+  r"""A sparse (coordinate format) alternative to ``Array``, for mostly-zero data.
+
+  Only the non-zero cells are stored: their flat (C-order) positions ``index`` in
+  sorted order, and their values ``data``. Memory scales with the number of non-zero
+  cells rather than the size of the space.
+
+  Args:
+    arr (float,array-like): a scalar zero, or dense data as accepted by ``Array``
+    space (Space): the space of the array
+    keys (list): the keys spanned by the array, as for ``Array``
+  """
+  __array_ufunc__ = None # defer numpy operators to the reflected methods below
+
+  def __init__(self,arr,space,keys):
+    self.space = space
+    self.keys  = keys
+    if np.ndim(arr) == 0 and arr == 0:
+      self.shape = space.subshape(keys)
+      self.index = np.array([],dtype=np.intp)
+      # same dtype as Array(arr,...): float for int / bool scalars
+      self.data  = np.array([],dtype=np.multiply(np.asarray(arr),np.ones(())).dtype)
+    else:
+      dense = Array(arr,space,keys).expand()
+      self.shape = dense.shape
+      self.index = np.flatnonzero(dense)
+      self.data  = np.asarray(dense).ravel()[self.index]
+
+  @classmethod
+  def fromflat(cls,index,data,space,keys,shape):
+    r"""Build a SparseArray directly from sorted unique flat positions and their values."""
+    obj = cls.__new__(cls)
+    obj.space = space
+    obj.keys  = keys
+    obj.shape = tuple(shape)
+    obj.index = index
+    obj.data  = data
+    return obj
+
+  @classmethod
+  def fromdense(cls,arr):
+    r"""Convert an ``Array`` to a SparseArray on the same space and keys."""
+    return cls(arr,arr.space,list(arr.keys))
+
+  def todense(self):
+    r"""Convert to a dense ``Array`` (explicitly allocating the full shape)."""
+    out = np.zeros(self.shape,dtype=self.dtype)
+    out.flat[self.index] = self.data
+    out = out.view(Array)
+    out.space = self.space
+    out.keys  = self.keys
+    return out
+
+  def __str__(self):
+    return '< SparseArray [{}] shape {} nnz {} >'.format(
+      ', '.join(str(key) for key in self.keys),
+      self.shape,
+      self.nnz,
+    )
+
+  def __repr__(self):
+    return str(self)
+
+  def __len__(self):
+    return self.shape[0]
+
+  @property
+  def ndim(self):
+    return len(self.shape)
+
+  @property
+  def size(self):
+    return int(np.prod(self.shape))
+
+  @property
+  def nnz(self):
+    return len(self.index)
+
+  @property
+  def dtype(self):
+    return self.data.dtype
+
+  @property
+  def nbytes(self):
+    return self.index.nbytes + self.data.nbytes
+
+  def copy(self):
+    return self.fromflat(self.index.copy(),self.data.copy(),self.space,self.keys,self.shape)
+
+  def __getitem__(self,key):
+    if isinstance(key,dict):
+      return self(**key)
+    if not isinstance(key,tuple):
+      key = (key,)
+    return self.select(positions(key,self.shape))
+
+  def __call__(self,**kwargs):
+    return self[self.space.slicer(self.keys,**kwargs)]
+
+  def slice(self,**select):
+    return self[self.space.slicer(self.keys,**select)]
+
+  def select(self,pos):
+    # sub-array at the outer product of per-axis positions
+    coords = np.unravel_index(self.index,self.shape)
+    mask = np.ones(self.nnz,dtype=bool)
+    remap = []
+    for c,p,n in zip(coords,pos,self.shape):
+      if len(p) == n and np.array_equal(p,np.arange(n)):
+        remap.append(None)
+        continue
+      new = np.full(n,-1,dtype=np.intp)
+      new[p] = np.arange(len(p))
+      mask &= new[c] >= 0
+      remap.append(new)
+    shape = tuple(len(p) for p in pos)
+    coords = [c[mask] if new is None else new[c[mask]] for c,new in zip(coords,remap)]
+    index = np.ravel_multi_index(coords,shape) if coords else np.zeros(0,dtype=np.intp)
+    order = np.argsort(index,kind='stable')
+    return self.fromflat(index[order],self.data[mask][order],self.space,self.keys,shape)
+
+  def update(self,arr,**select):
+    arr = np.asarray(arr)
+    if select:
+      pos = positions(self.space.slicer(self.keys,**select),self.shape)
+      shape = tuple(len(p) for p in pos)
+      target = np.ravel(np.ravel_multi_index(np.ix_(*pos),self.shape))
+    else:
+      shape = self.shape
+      target = np.arange(self.size)
+    values = (np.broadcast_to(arr,shape) if arr.size == 1 else arr.reshape(shape)).ravel()
+    keep = ~np.isin(self.index,target)
+    nonzero = values != 0
+    index = np.concatenate([self.index[keep],target[nonzero]])
+    # values are not truncated: the dtype is promoted if needed
+    data = np.concatenate([self.data[keep],values[nonzero]]).astype(np.result_type(self.data,values),copy=False)
+    order = np.argsort(index,kind='stable')
+    self.index = index[order]
+    self.data  = data[order]
+    return self
+
+  def gather(self,other):
+    # values of dense / scalar other at the stored cells (other must broadcast to self)
+    if isinstance(other,Array):
+      other = other.expand()
+    other = np.asarray(other)
+    if other.ndim == 0:
+      return other
+    if np.broadcast_shapes(self.shape,other.shape) != self.shape:
+      raise ValueError('Cannot broadcast shape {} to sparse shape {}'.format(other.shape,self.shape))
+    coords = np.unravel_index(self.index,self.shape)
+    return np.broadcast_to(other,self.shape)[coords]
+
+  def combine(self,other,sign):
+    # self + sign*other for sparse other with the same shape: union of stored cells
+    if other.shape != self.shape:
+      raise ValueError('Sparse operands must have the same shape: {} vs {}'.format(self.shape,other.shape))
+    index,inverse = np.unique(np.concatenate([self.index,other.index]),return_inverse=True)
+    data = np.zeros(len(index),dtype=np.result_type(self.data,other.data))
+    np.add.at(data,inverse,np.concatenate([self.data,sign*other.data]))
+    return self.compress(index,data)
+
+  def compress(self,index,data):
+    nonzero = data != 0
+    return self.fromflat(index[nonzero],data[nonzero],self.space,self.keys,self.shape)
+
+  def densify(self,op):
+    raise ValueError('SparseArray {} would create a dense result; use todense() first'.format(op))
+
+  def __neg__(self):
+    return self.fromflat(self.index,-self.data,self.space,self.keys,self.shape)
+
+  def __add__(self,other):
+    if isinstance(other,SparseArray):
+      return self.combine(other,1)
+    if np.ndim(other) == 0 and other == 0:
+      return self.copy()
+    return self.densify('addition')
+
+  def __radd__(self,other):
+    return self.__add__(other)
+
+  def __sub__(self,other):
+    if isinstance(other,SparseArray):
+      return self.combine(other,-1)
+    if np.ndim(other) == 0 and other == 0:
+      return self.copy()
+    return self.densify('subtraction')
+
+  def __rsub__(self,other):
+    return (-self).__add__(other)
+
+  def __mul__(self,other):
+    if isinstance(other,SparseArray):
+      if other.shape != self.shape:
+        raise ValueError('Sparse operands must have the same shape: {} vs {}'.format(self.shape,other.shape))
+      index,i,j = np.intersect1d(self.index,other.index,assume_unique=True,return_indices=True)
+      return self.compress(index,self.data[i]*other.data[j])
+    return self.compress(self.index,self.data*self.gather(other))
+
+  def __rmul__(self,other):
+    return self.__mul__(other)
+
+  def __truediv__(self,other):
+    if isinstance(other,SparseArray):
+      return self.densify('division by a SparseArray')
+    return self.compress(self.index,self.data/self.gather(other))
+
+  def __rtruediv__(self,other):
+    return self.densify('division')
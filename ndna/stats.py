@@ -0,0 +1,187 @@
+r"""Opt-in instrumentation: counters, bytes allocated and time spent in hot paths
+
+Instrumentation is installed by wrapping the relevant methods only while a
+:func:`collect` context is active, so there is no overhead at all otherwise.
+Each context only records the calls made in its own thread.
+
+Example:
+  >>> with collect() as rec:
+  ...   run_model()
+  >>> print(rec.summary())
+"""
+import os
+import sys
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+import numpy as np
+from .space import Space,Array
+from .ops import Selector
+
+PACKAGE = os.path.dirname(os.path.abspath(__file__))
+
+# the Registries recording calls in this thread / context
+recording = contextvars.ContextVar('recording',default=())
+
+# guards installing the instruments: the number of active collect() contexts and the original methods
+lock = threading.Lock()
+active = 0
+saved = []
+
+def callsite():
+  r"""Return ``'file:line'`` of the innermost caller outside the ndna package."""
+  frame = sys._getframe(1)
+  while frame is not None and os.path.dirname(os.path.abspath(frame.f_code.co_filename)) == PACKAGE:
+    frame = frame.f_back
+  if frame is None:
+    return '?'
+  return '{}:{}'.format(frame.f_code.co_filename,frame.f_lineno)
+
+class Registry():
+  r"""Counters keyed by (event, detail, call site), each holding [calls, bytes, seconds]."""
+  def __init__(self):
+    self.data = {}
+
+  def record(self,event,detail,nbytes=0,seconds=0.0):
+    r"""Add one call of **event** (e.g. ``'Space.compile'``) with **detail** (e.g. ``'fast'``)."""
+    entry = self.data.setdefault((event,detail,callsite()),[0,0,0.0])
+    entry[0] += 1
+    entry[1] += nbytes
+    entry[2] += seconds
+
+  def totals(self,bysite=False):
+    r"""Return ``{(event, detail[, site]): [calls, bytes, seconds]}``, summed over sites unless **bysite**."""
+    out = {}
+    for (event,detail,site),values in self.data.items():
+      entry = out.setdefault((event,detail,site) if bysite else (event,detail),[0,0,0.0])
+      for i,value in enumerate(values):
+        entry[i] += value
+    return out
+
+  def count(self,event,detail=None):
+    r"""Return the number of recorded calls of **event** (and **detail**, if given)."""
+    return sum(values[0] for (e,d,_),values in self.data.items()
+               if e == event and (detail is None or d == detail))
+
+  def summary(self,bysite=True):
+    r"""Return a table of all counters, sorted by time spent."""
+    rows = sorted(self.totals(bysite).items(),key=lambda item: -item[1][2])
+    lines = ['{:<16} {:<12} {:>10} {:>14} {:>12}  {}'.format(
+      'event','detail','calls','bytes','seconds','site' if bysite else '')]
+    for key,(calls,nbytes,seconds) in rows:
+      lines.append('{:<16} {:<12} {:>10d} {:>14,d} {:>12.6f}  {}'.format(
+        key[0],key[1],calls,nbytes,seconds,key[2] if bysite else ''))
+    return '\n'.join(line.rstrip() for line in lines)
+
+def slicerpath(slicer):
+  # which Space.compile path produced slicer
+  if any(item is None for item in slicer):
+    return 'fast'
+  if sum(isinstance(item,np.ndarray) for item in slicer) > 1:
+    return 'ix'
+  return 'slices'
+
+def record(event,detail,nbytes=0,seconds=0.0):
+  # record one call in each Registry of this context
+  for registry in recording.get():
+    registry.record(event,detail,nbytes,seconds)
+
+def instruments():
+  # (class, attribute, wrapper factory) for each instrumented method;
+  # wrappers only measure calls made in contexts which are recording
+  clock = time.perf_counter
+  def space_slicer(fun):
+    def wrapper(self,keys=None,**kwargs):
+      if not recording.get():
+        return fun(self,keys,**kwargs)
+      hits,t0 = self.cache.hits,clock()
+      out = fun(self,keys,**kwargs)
+      record('Space.slicer','hit' if self.cache.hits > hits else 'miss',0,clock()-t0)
+      return out
+    return wrapper
+  def space_compile(fun):
+    def wrapper(self,keys=None,**kwargs):
+      if not recording.get():
+        return fun(self,keys,**kwargs)
+      t0 = clock()
+      out = fun(self,keys,**kwargs)
+      record('Space.compile',slicerpath(out),0,clock()-t0)
+      return out
+    return wrapper
+  def selector_call(fun):
+    def wrapper(self,arr):
+      if not recording.get():
+        return fun(self,arr)
+      detail = 'hit' if arr.shape in self.pre else ('miss' if self.memory else 'nomemory')
+      t0 = clock()
+      out = fun(self,arr)
+      record('Selector.pre',detail,0,clock()-t0)
+      return out
+    return wrapper
+  def array_new(fun):
+    def wrapper(cls,arr,*args,**kwargs):
+      if not recording.get():
+        return fun(cls,arr,*args,**kwargs)
+      t0 = clock()
+      out = fun(cls,arr,*args,**kwargs)
+      copy = not (isinstance(arr,np.ndarray) and np.may_share_memory(out,arr)) and not out.isbroadcast
+      record('Array.__new__','copy' if copy else 'view',out.nbytes if copy else 0,clock()-t0)
+      return out
+    return staticmethod(wrapper)
+  def array_ufunc(fun):
+    def wrapper(self,ufunc,method,*inputs,**kwargs):
+      if not recording.get():
+        return fun(self,ufunc,method,*inputs,**kwargs)
+      t0 = clock()
+      out = fun(self,ufunc,method,*inputs,**kwargs)
+      copy = kwargs.get('out') is None and isinstance(out,np.ndarray)
+      record('Array.ufunc','copy' if copy else 'inplace',out.nbytes if copy else 0,clock()-t0)
+      return out
+    return wrapper
+  return [
+    (Space,'slicer',space_slicer),
+    (Space,'compile',space_compile),
+    (Selector,'__call__',selector_call),
+    (Array,'__new__',array_new),
+    (Array,'__array_ufunc__',array_ufunc),
+  ]
+
+def install():
+  # wrap the instrumented methods, unless another collect() context already did
+  global active
+  with lock:
+    if active == 0:
+      for cls,name,factory in instruments():
+        saved.append((cls,name,vars(cls)[name]))
+        setattr(cls,name,factory(getattr(cls,name)))
+    active += 1
+
+def uninstall():
+  # restore the original methods once the last collect() context exits
+  global active
+  with lock:
+    active -= 1
+    if active == 0:
+      while saved:
+        cls,name,raw = saved.pop()
+        setattr(cls,name,raw)
+
+@contextmanager
+def collect(registry=None):
+  r"""Record instrumentation counters within this context.
+
+  Args:
+    registry (Registry): an existing registry to add to, else a new one
+
+  Yields:
+    (Registry): the registry of counters
+  """
+  registry = Registry() if registry is None else registry
+  install()
+  token = recording.set(recording.get()+(registry,))
+  try:
+    yield registry
+  finally:
+    recording.reset(token)
+    uninstall()
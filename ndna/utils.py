@@ -1,6 +1,7 @@
 r"""Utility functions
 """
 
+import threading
 from collections import OrderedDict as odict
 
 def unique(iterobj):
@@ -64,3 +65,91 @@ def flatten(obj):
   else:
     out.append(obj)
   return out
+
+def freeze(obj):
+  r"""Convert **obj** into a hashable equivalent for use as a cache key.
+
+  Dictionaries become sorted tuples of (key, value) pairs, non-string iterables
+  (including ``np.ndarray``) become flat tuples (see :func:`flatten`), and
+  ``slice`` objects become ``('slice', start, stop, step)`` tuples.
+
+  Args:
+    obj (object): any object
+
+  Returns:
+    (object): a hashable representation of **obj**
+  """
+  if isinstance(obj,dict):
+    return tuple(sorted((k,freeze(v)) for k,v in obj.items()))
+  if isinstance(obj,slice):
+    return ('slice',obj.start,obj.stop,obj.step)
+  if hasattr(obj,'__iter__') and not isinstance(obj,str):
+    return tuple(flatten(obj))
+  return obj
+
+class LRUCache():
+  r"""A bounded, thread-safe mapping which evicts the least recently used entry when full.
+
+  Entries are computed while holding the cache lock, so threads sharing the cache
+  compute each entry only once.
+
+  Args:
+    maxsize (int): maximum number of entries: ``None`` = unbounded; ``0`` = no caching
+
+  Attributes:
+    hits (int): number of lookups which found an existing entry
+    misses (int): number of lookups which had to compute the entry
+  """
+  def __init__(self,maxsize=128):
+    self.maxsize = maxsize
+    self.hits    = 0
+    self.misses  = 0
+    self.data    = odict()
+    self.lock    = threading.RLock()
+
+  def __getstate__(self):
+    state = self.__dict__.copy()
+    del state['lock']
+    return state
+
+  def __setstate__(self,state):
+    self.__dict__.update(state)
+    self.lock = threading.RLock()
+
+  def __len__(self):
+    return len(self.data)
+
+  def __contains__(self,key):
+    return key in self.data
+
+  def fetch(self,key,fun):
+    r"""Return the entry for **key**, computing it as ``fun()`` if missing.
+
+    Args:
+      key (hashable): the cache key
+      fun (callable): called without arguments to compute the entry on a miss
+
+    Returns:
+      (object): the cached or newly computed entry
+    """
+    with self.lock:
+      try:
+        value = self.data[key]
+      except KeyError:
+        self.misses += 1
+        value = fun()
+        if self.maxsize != 0:
+          self.data[key] = value
+          if self.maxsize is not None and len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+        return value
+      self.hits += 1
+      self.data.move_to_end(key)
+      return value
+
+  def clear(self):
+    r"""Remove all entries and reset the hit / miss counters."""
+    with self.lock:
+      self.data.clear()
+      self.hits   = 0
+      self.misses = 0
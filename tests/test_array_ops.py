@@ -1,7 +1,9 @@
 import pytest
 import numpy as np
 import copy
-from ndna.ops import Selector
+from ndna.utils import odict
+from ndna.space import Dimension,Space,Array
+from ndna.ops import Selector,SelectorSet
 from tests import data
 
 # TODO: performance benchmarking vs np.ndarray as another badge
@@ -24,6 +26,46 @@ def test_array_ops():
   assert (1 / data.Xik).keys == ['i','k']
   assert (data.Xi / data.Xk).keys == ['i','k']
 
+def test_array_align():
+  Xik = data.Xik.compact()
+  Xki = Xik.T
+  Xki.keys = ['k','i']
+  # Array.compact & Array.expand
+  assert Xik.shape == (3,2) and Xik.keys == ['i','k']
+  assert np.shares_memory(Xik,data.Xik)
+  assert data.Xijk.compact() is data.Xijk
+  assert Xki.expand().shape == (3,1,2)
+  assert np.shares_memory(Xki.expand(),data.Xik)
+  assert np.all(Xki.expand() == data.Xik)
+  # Space.align
+  X1,X2,keys = data.space.align(Xki,data.Xijk)
+  assert X1.shape == (3,1,2) and X2 is data.Xijk and keys == ['i','j','k']
+  assert data.space.align(Xik,Xik)[2] == ['i','k']
+  bad = Xik.view()
+  bad.keys = ['i']
+  with pytest.raises(ValueError,match='Cannot align'):
+    data.space.align(bad,data.Xijk)
+  assert not isinstance(Xik[0],Array)
+  cube = Space([Dimension(key,key,[0,1]) for key in 'ijk'])
+  Xjk = Array([[0,1],[2,3]],cube,['j','k'])
+  assert not isinstance(Xjk[:,:,0],Array) and not isinstance(Xjk[0,:,:],Array)
+  assert isinstance(Xjk[:,:,0:1],Array) and Xjk[:,:,0:1].keys == ['j','k']
+  # operators
+  assert np.all(Xki + data.Xijk == data.Xik + data.Xijk)
+  assert (Xki * data.Xijk).keys == ['i','j','k']
+  assert np.all(Xki - data.Xi == data.Xik - data.Xi)
+  assert (Xik / Xik).shape == (3,2)
+  assert (Xik / Xik).keys == ['i','k']
+  # full-rank arrays with keys out of space order
+  space = Space([Dimension('a','a',[0,1]),Dimension('b','b',[0,1])])
+  A = Array([[1,2],[3,4]],space,['a','b'])
+  At = A.T
+  At.keys = ['b','a']
+  assert space.layout(At) == ('b','a') and space.layout(A) is None
+  assert np.all(A + At == 2*A) and (A + At).keys == ['a','b']
+  assert np.all(At.sum('a') == A.sum('a')) and At.expand().shape == (2,2)
+  assert Array([[1,2],[3,4]],space,['b','a']).keys == ['a','b']
+
 def test_selector():
   csio = copy.deepcopy(data.sio)
   csio.register(data.Xik.shape)
@@ -43,5 +85,160 @@ def test_selector():
   assert data.Xik.shape in csio.pre
   # Selector.merge
   assert data.si.merge(data.sk) == data.sik
+  other = Space([Dimension('sex','k',['female','male']),Dimension('age','j',[20,10])])
+  merged = data.si.merge(Selector('s',other,k='female',j=20))
+  assert merged.space is data.space and merged.locate()['j'].tolist() == [1]
+  with pytest.raises(ValueError,match='not in list'):
+    data.si.merge(Selector('s',Space([Dimension('age','j',[15])]),j=15))
   # complex operations
   assert data.Xijk[data.sj3.merge(data.si)].shape == (1,3,2)
+  # Selector.locate
+  assert data.sj3.locate()['j'].tolist() == [0,1,2]
+  assert data.si.merge(data.sj3).positions['i'].tolist() == [0]
+  # Selector.compile & Selector.take & Selector.put
+  assert data.si.compile(data.Xik.shape).tolist() == [[[0,1]]]
+  assert data.Xik.shape in data.si.flat
+  data.sio.compile(data.Xik.shape)
+  assert data.Xik.shape not in data.sio.flat
+  for s in [data.si,data.sk,data.sik,data.sj3,data.sj3.merge(data.si)]:
+    assert np.array_equal(s.take(data.Xijk),s(data.Xijk))
+  X = data.Xijk.copy()
+  assert np.all(data.sik.put(X,-1)(i='high',k='female') == -1)
+  assert X.sum() == data.Xijk.sum() - data.Xijk(i='high',k='female').sum() - 7
+  with pytest.raises(ValueError,match='canonical shape of 3 axes'):
+    data.sk.take(data.Xik.compact())
+  assert np.array_equal(data.sk.take(data.Xik.compact().expand()),data.sk(data.Xik))
+
+def test_selector_set():
+  ss = SelectorSet([data.si,data.sk,data.sj3])
+  assert str(ss) == '< SelectorSet ["si", "sk", "sj2"] >'
+  assert ss.names == ['si','sk','sj2']
+  # SelectorSet.__call__
+  out = ss(data.Xijk)
+  assert list(out) == ss.names
+  assert all(np.array_equal(out[s.name],s(data.Xijk)) for s in ss)
+  assert data.Xijk.shape in ss.pre
+  # SelectorSet.stack
+  stack = SelectorSet([data.si,Selector('sl',data.space,i='low')]).stack(data.Xijk)
+  assert stack.shape == (2,1,7,2)
+  assert np.array_equal(stack[1],data.Xijk(i='low'))
+  with pytest.raises(ValueError,match='Cannot stack'):
+    ss.stack(data.Xijk)
+  with pytest.raises(ValueError,match='canonical shape'):
+    SelectorSet([data.sk])(data.Xik.compact())
+
+def test_array_ufunc():
+  X = data.Xijk.astype(float)
+  Xki = data.Xik.compact().T
+  Xki.keys = ['k','i']
+  # elementwise
+  assert np.exp(X).keys == ['i','j','k']
+  assert np.maximum(data.Xik,data.Xijk).keys == ['i','j','k']
+  assert np.maximum(Xki,data.Xi).shape == (3,1,2)
+  assert np.maximum(Xki,data.Xi).keys == ['i','k']
+  assert np.divmod(X,2)[1].keys == ['i','j','k']
+  assert isinstance(np.sqrt(data.Xi.view(np.ndarray)),np.ndarray)
+  # in-place & out
+  Y = X.copy()
+  Y **= 2
+  assert Y.keys == ['i','j','k'] and Y[0,1,1] == 9
+  Z = X.copy()
+  assert np.add(X,1,out=Z) is Z
+  assert np.all(Z == X+1)
+  Xc = data.Xik.astype(float).compact()
+  Xc += data.Xi
+  assert Xc.shape == (3,2) and Xc.keys == ['i','k']
+  assert np.all(Xc == np.array([[2,3],[5,6],[8,9]]))
+  # reductions
+  assert X.sum() == 861
+  assert X.sum(axis=1).keys == ['i','k']
+  assert X.sum(axis=1).shape == (3,2)
+  assert X.sum(axis=1,keepdims=True).shape == (3,1,2)
+  assert np.all(X.mean(axis=(0,2)) == np.array([14.5,16.5,18.5,20.5,22.5,24.5,26.5]))
+  assert X.mean(axis=(0,2)).keys == ['j']
+  assert np.sum(data.Xik,axis=0).keys == ['k']
+  assert np.all(Xki.sum(axis=0) == np.array([3,7,11]))
+  assert Xki.sum(axis=0).keys == ['i']
+  out = Array(0.,data.space,['i','k']).compact()
+  assert np.add.reduce(X,axis=1,out=out) is out
+  assert np.all(out == X.sum(axis=1))
+  out = np.zeros((3,2))
+  np.add.reduce(X,axis=1,out=out)
+  assert np.all(out == X.sum(axis=1))
+  assert X.cumsum(axis=1).keys == ['i','j','k']
+  # keepdims and std / var keep the layout of compact and transposed Arrays
+  Xc = data.Xik.astype(float).compact()
+  assert Xc.sum('i',keepdims=True).shape == (1,2) and Xc.sum('i',keepdims=True).keys == ['i','k']
+  Xki = Xc.T
+  Xki.keys = ['k','i']
+  assert Xki.mean('i',keepdims=True).shape == (2,1)
+  assert np.allclose(Xki.std('i'),[1.63299316,1.63299316]) and Xki.std('i').keys == ['k']
+  assert np.allclose(Xki.var('k'),np.asarray(Xc).var(axis=1)) and np.allclose(Xc.std('k'),Xki.std('k'))
+  T = X.transpose(2,1,0)
+  T.keys = ['k','j','i']
+  assert T.sum('j').keys == ['k','i'] and np.all(np.asarray(T.sum('j')) == np.asarray(X.sum('j').compact()).T)
+  assert np.allclose(np.asarray(T.std('j')),np.asarray(X.std('j').compact()).T)
+  S = X(i=['high','low'],k='female')
+  assert S.sum('j').shape == (2,1) and np.all(S.sum('j') == np.asarray(S).sum(axis=1))
+  # spaces: structurally equal spaces combine
+  assert np.all(X + Array(1,Space(data.space.dims),['k']) == X + 1)
+  with pytest.raises(ValueError,match='different spaces'):
+    X + Array(0,Space(data.space.dims[:2]),[])
+
+def test_array_reindex():
+  space = Space([Dimension('sex','k',['female','male','other']),Dimension('age','j',[20,40,80])])
+  # Array.reindex
+  X = data.Xijk.sum('i')
+  Y = X.reindex(space)
+  assert Y.space is space and Y.keys == ['k','j'] and Y.shape == (3,3)
+  assert np.array_equal(Y.view(np.ndarray),[[51,63,np.nan],[48,60,np.nan],[np.nan]*3],equal_nan=True)
+  Y = Array([5,6],data.space,['k']).reindex(space,fill=0)
+  assert Y.dtype == int and Y.shape == (3,1) and Y.ravel().tolist() == [6,5,0]
+  assert Y.reindex(space) is Y
+  assert np.all(Y.reindex(data.space).view(np.ndarray) == [[[5,6]]])
+  assert np.all(Y(k='male') == 5) and np.all(Y + Y.reindex(space) == 2*Y)
+  with pytest.raises(ValueError,match='Key "i" is not in space'):
+    data.Xi.reindex(space)
+  with pytest.raises(ValueError,match='sliced Array'):
+    X.expand()(j=20).reindex(space)
+  # Space.reindexer
+  hits = space.plans.hits
+  X.reindex(space)
+  assert space.plans.hits == hits+1
+  flat,mask = space.reindexer(data.space,('j','k'))
+  assert flat.shape == mask.shape == (3,3) and mask.sum() == 5
+
+def test_array_named():
+  X = data.Xijk.astype(float)
+  W = Array([1,2,3,4,5,6,7],data.space,['j'])
+  # Array.axes
+  assert X.axes('j') == 1
+  assert X.axes(['k',0]) == (2,0)
+  assert X.sum('i').axes('k') == 1
+  with pytest.raises(ValueError,match='not an axis'):
+    X.sum('i').axes('i')
+  # named reductions
+  assert np.all(X.sum('j') == X.sum(axis=1))
+  assert X.sum('j').keys == ['i','k']
+  assert X.sum(['i','k']).keys == ['j']
+  assert X.sum('j',keepdims=True).shape == (3,1,2)
+  assert np.all(X.max('k') == X[:,:,1])
+  assert X.mean('j').keys == ['i','k']
+  # Array.average
+  assert np.all(X.average('j') == X.mean('j'))
+  assert X.average('j',weights=W).keys == ['i','k']
+  assert X.average('j',weights=W)[0,0] == (np.arange(0,14,2)*np.arange(1,8)).sum()/28
+  assert np.allclose(data.Xi.average('i',weights=data.Xik),[22/9,28/12])
+  # Array.group
+  groups = odict([('young',[10,20,30]),('old',[40,50,60,70])])
+  G = X.group('j',groups)
+  assert G.shape == (3,2,2) and G.keys == ['i','j','k']
+  assert G.space.dim['j'].values == ('young','old')
+  assert np.all(np.asarray(G(j='young')) == X(j=[10,20,30]).sum('j',keepdims=True))
+  assert G.space is X.group('j',lambda v: 'young' if v < 40 else 'old').space
+  assert np.all(X.group('j',{'b':[50,10],'a':[70]})[0,:,0] == [8,12])
+  assert X.sum('i').group('j',{'a':[10,20]}).shape == (1,2)
+  with pytest.raises(ValueError,match='at least one value'):
+    X.group('j',{'a':[]})
+  with pytest.raises(ValueError,match='not an axis'):
+    data.Xi.group('j',groups)
@@ -0,0 +1,62 @@
+import gc
+import pytest
+import numpy as np
+from ndna.space import Array
+from ndna.derived import Derived,dependents,regionslicer
+from tests import data
+
+def test_derived():
+  X = data.Xijk.astype(float)
+  Y = data.Xik.astype(float)
+  T = Derived(lambda X: X.sum('j'),X)
+  R = Derived(lambda X: X / X.sum('j',keepdims=True),X,over=['j'])
+  C = Derived(lambda T,Y: T*Y+1,T,Y)
+  def check():
+    assert np.allclose(T.get(),X.sum('j')) and T.get().keys == ['i','k']
+    assert np.allclose(R.get(),X / X.sum('j',keepdims=True)) and R.get().keys == ['i','j','k']
+    assert np.allclose(C.get(),X.sum('j')*Y+1)
+  check()
+  assert [D.counts for D in (T,R,C)] == [{'full':1,'region':0}]*3
+  assert str(T) == '< Derived <lambda> of 1 inputs >'
+  # Array.update: only the updated region is recomputed
+  value = T.get()
+  X.update([5.,5.],i='low',j=20)
+  X.update(np.full(7,7.),i='high',k='female')
+  assert T.dirty['i'].tolist() == [0,2] and 'k' not in T.dirty and 'j' not in R.dirty
+  assert str(T) == '< Derived <lambda> of 1 inputs (dirty) >'
+  check()
+  assert T.get() is value
+  assert [D.counts for D in (T,R,C)] == [{'full':1,'region':1}]*3
+  Y.update([2.,3.],i='medium')
+  check()
+  assert [D.counts['region'] for D in (T,R,C)] == [1,1,2]
+  # Array.updatemany & Array.updatetable
+  X.updatemany([({'i':'medium','j':[10,70]},1.),({'i':'low','j':30},2.)])
+  check()
+  X.updatetable({'i':['low','high'],'j':[10,60],'k':['male','male']},[9.,8.])
+  check()
+  assert [D.counts for D in (T,R,C)] == [{'full':1,'region':3}]*2+[{'full':1,'region':4}]
+  # whole updates are recomputed in full
+  X.update(np.arange(42.)+1)
+  check()
+  assert T.counts == {'full':2,'region':3}
+  # inputs
+  with pytest.raises(ValueError,match='whole, writable Arrays'):
+    Derived(lambda X: X,Array(1.,data.space,['i'],broadcast=True))
+  with pytest.raises(ValueError,match='whole, writable Arrays'):
+    Derived(lambda X: X,Array(1.,data.space,[],broadcast=True))
+  with pytest.raises(ValueError,match='whole, writable Arrays'):
+    Derived(lambda X: X,X(i='low'))
+  # registry cleanup
+  del T,R,C
+  gc.collect()
+  assert id(X) not in dependents and id(Y) not in dependents
+
+def test_regionslicer():
+  keys = ('i','j','k')
+  assert regionslicer((3,7,2),keys,{}) == (slice(None),)*3
+  assert regionslicer((3,7,2),keys,{'j':np.array([1,3,5])}) == (slice(None),slice(1,7,2),slice(None))
+  assert regionslicer((3,1,2),keys,{'j':np.array([1,3,5])}) == (slice(None),)*3
+  X = np.arange(42).reshape(3,7,2)
+  region = {'i':np.array([0,2]),'j':np.array([0,1,5])}
+  assert np.array_equal(X[regionslicer(X.shape,keys,region)],X[[0,2]][:,[0,1,5]])
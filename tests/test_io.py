@@ -1,6 +1,12 @@
 import os
+import io
+import csv
 import pytest
-from ndna.io import loadjson,makedir,odict
+import numpy as np
+import simplejson as json
+from ndna.space import Array
+from ndna.io import loadjson,loaddims,iterjson,loadjsonarray,makedir,odict,dumpspace,savearray,loadarray,savecsv
+from tests import data
 
 datadir = os.path.join('tests','data')
 dimjson = os.path.join(datadir,'dimensions.json')
@@ -14,6 +20,40 @@ def test_loadjson():
   assert isinstance(loadjson(dimjson,ordered=True),odict)
   assert not isinstance(loadjson(dimjson,ordered=False),odict)
 
+def test_loaddims():
+  dims = loaddims(dimjson)
+  assert [dim.key for dim in dims] == ['i','j','k']
+  assert [dim.values for dim in dims] == [dim.values for dim in data.space.dims]
+  with open(dimjson,'r') as f:
+    spec = json.load(f)
+  assert [dim.name for dim in dims] == [spec[key]['name'] for key in spec]
+
+def test_loadjsonarray(tmp_path):
+  fname = str(tmp_path / 'X.json')
+  X = np.arange(42.).reshape(3,7,2)*1.5-7
+  with open(fname,'w') as f:
+    json.dump(X.tolist(),f)
+  for chunksize in [1,3,64,2**20]:
+    A = loadjsonarray(fname,data.space,['i','j','k'],chunksize=chunksize)
+    assert A.keys == ['i','j','k'] and np.all(A.view(np.ndarray) == X)
+  # field
+  with open(fname,'w') as f:
+    json.dump(odict([('meta',{'n':[1,2]}),('data',X[:,0,:].astype(int).tolist()),('tail',[9])]),f,indent=1)
+  for chunksize in [1,5,2**20]:
+    A = loadjsonarray(fname,data.space,['i','k'],field='data',dtype=int,chunksize=chunksize)
+    assert A.dtype == int and np.all(A.view(np.ndarray) == X[:,0,:].astype(int).reshape((3,1,2)))
+  with pytest.raises(ValueError,match='not found'):
+    loadjsonarray(fname,data.space,['i'],field='lorem')
+  with pytest.raises(ValueError,match='more than 3 values'):
+    loadjsonarray(fname,data.space,['i'],field='data')
+  with pytest.raises(ValueError,match='has 1 values'):
+    loadjsonarray(fname,data.space,['i'],field='tail')
+  # iterjson
+  with open(fname,'w') as f:
+    f.write('{"data": [[1, null], [3e2, -4]]}')
+  values = np.concatenate(list(iterjson(fname,field='data',chunksize=3)))
+  assert np.array_equal(values,[1,np.nan,300,-4],equal_nan=True)
+
 def test_makedirs():
   with pytest.raises(TypeError,match='argument must be str'):
     makedir(None)
@@ -24,3 +64,42 @@ def test_makedirs():
   makedir(directory)
   assert os.path.exists(directory)
   os.rmdir(directory)
+
+def test_savearray(tmp_path):
+  fname = str(tmp_path / 'X')
+  # dumpspace
+  assert dumpspace(data.space)[1] == {'name':'age','key':'j','values':[10,20,30,40,50,60,70]}
+  # savearray & loadarray
+  savearray(fname,data.Xik)
+  assert os.path.exists(fname+'.json') and os.path.exists(fname+'.npy')
+  X = loadarray(fname)
+  assert X.keys == ['i','k'] and X.dtype == data.Xik.dtype
+  assert np.all(X.view(np.ndarray) == data.Xik.view(np.ndarray))
+  assert [dim.values for dim in X.space.dims] == [dim.values for dim in data.space.dims]
+  assert X(i='low',k='female') == 6
+  X = loadarray(fname,mmap_mode='r',space=data.space)
+  assert isinstance(X.base,np.memmap) and X.space is data.space
+  assert np.all(X == data.Xik)
+  savearray(fname,data.Xijk.sum('j'))
+  assert loadarray(fname).shape == (3,1,2)
+  assert np.all(loadarray(fname).view(np.ndarray) == data.Xijk.sum('j',keepdims=True).view(np.ndarray))
+  with pytest.raises(ValueError,match='Cannot save a sliced Array'):
+    savearray(str(tmp_path / 'S'),data.Xijk(i='high'))
+  assert not os.path.exists(str(tmp_path / 'S.json'))
+
+def test_savecsv(tmp_path):
+  fname = str(tmp_path / 'X.csv')
+  X = data.Xijk.astype(float)/4
+  for chunksize in [5,2**16]:
+    savecsv(fname,X,chunksize=chunksize)
+    with open(fname,'r') as f:
+      rows = list(csv.reader(f))
+    assert rows[0] == ['i','j','k','value'] and rows[1] == ['high','10','male','0.0'] and len(rows) == 43
+    columns = dict(zip(rows[0],map(list,zip(*rows[1:]))))
+    columns['j'] = [int(j) for j in columns['j']]
+    columns['value'] = [float(v) for v in columns['value']]
+    assert np.all(Array.fromrecords(columns,data.space,missing='error') == X)
+  # file-like, TSV, format
+  f = io.StringIO()
+  savecsv(f,data.Xik.compact(),sep='\t',header=False,fmt='%.1f')
+  assert f.getvalue().splitlines()[:2] == ['high\tmale\t1.0','high\tfemale\t2.0']
@@ -0,0 +1,53 @@
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from ndna.space import Dimension,Space,Array
+from ndna.lazy import Expr,defer,deferred
+from tests import data
+
+def test_deferred():
+  X = data.Xijk.astype(float)
+  eager = X * data.Xik + data.Xi - data.Xk
+  with deferred():
+    Y = X * data.Xik + data.Xi - data.Xk
+  assert isinstance(Y,Expr)
+  assert str(Y) == 'subtract(add(multiply(Array[i,j,k], Array[i,k]), Array[i]), Array[k])'
+  assert isinstance(X + 1,Array)
+  # Expr.leaves
+  assert len(Y.leaves()) == 4
+  # Expr.evaluate
+  for chunkbytes in [8,64,2**20]:
+    Z = Y.evaluate(chunkbytes=chunkbytes)
+    assert isinstance(Z,Array) and Z.keys == ['i','j','k']
+    assert np.array_equal(Z,eager) and Z.dtype == eager.dtype
+  # deferred() applies to this thread only
+  with deferred():
+    with ThreadPoolExecutor(1) as pool:
+      assert isinstance(pool.submit(lambda: data.Xi + 1).result(),Array)
+    assert isinstance(data.Xi + 1,Expr)
+
+def test_evaluate_memory():
+  space = Space([Dimension('i','i',[0,1,2]),Dimension('j','j',range(500)),Dimension('k','k',range(200))])
+  X = Array(np.arange(3*500*200.),space,['i','j','k'])
+  Xik = Array(np.arange(600.),space,['i','k'])
+  with deferred():
+    Y = X * Xik + 1 - Xik
+  tracemalloc.start()
+  try:
+    Z = Y.evaluate(chunkbytes=2**16)
+    peak = tracemalloc.get_traced_memory()[1]
+  finally:
+    tracemalloc.stop()
+  # the output plus a few chunk-sized temporaries (eager: two full-size arrays)
+  assert peak < Z.nbytes + 8 * 2**16
+  assert np.array_equal(Z,X * Xik + 1 - Xik)
+
+def test_defer():
+  Xc = data.Xik.compact()
+  Z = (np.exp(defer(Xc)) * 2 + Xc).evaluate(chunkbytes=8)
+  assert Z.keys == ['i','k'] and Z.shape == (3,2)
+  assert np.array_equal(Z,np.exp(Xc) * 2 + Xc)
+  Z = (defer(data.Xijk) * np.arange(2)).evaluate(chunkbytes=16)
+  assert np.array_equal(Z,data.Xijk * np.arange(2)) and Z.keys == ['i','j','k']
+  assert (defer(3) + 2).evaluate() == 5
+  assert str(defer(np.zeros(2)) + 2) == 'add(ndarray(2,), 2)'
@@ -0,0 +1,60 @@
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from ndna import space as nspace
+from ndna.space import Array
+from ndna.ops import Selector
+from ndna.parallel import Threads,threaded
+from tests import data
+
+def test_threaded():
+  X = data.Xijk.astype(float)
+  serial = [X*data.Xik+data.Xi,(X*data.Xik).sum('j'),X.sum(),X.max('i'),X.mean(('i','k')),np.subtract.reduce(X,axis=0)]
+  with threaded(workers=3,minsize=1) as threads:
+    assert nspace.threads.get() is threads and threads.chunks(7) == [(0,2),(2,4),(4,7)]
+    names = set()
+    run = threads.map
+    threads.map = lambda fun,chunks: names.update([len(chunks)]) or run(fun,chunks)
+    result = [X*data.Xik+data.Xi,(X*data.Xik).sum('j'),X.sum(),X.max('i'),X.mean(('i','k')),np.subtract.reduce(X,axis=0)]
+    out = np.zeros(X.shape)
+    assert np.add(X,1,out=out) is out and np.all(out == X+1)
+    # nested lists are split along the leading axis like arrays
+    assert np.array_equal(X + [[[1]],[[2]],[[3]]],X.view(np.ndarray) + [[[1]],[[2]],[[3]]])
+    # threaded() applies to this thread only
+    with ThreadPoolExecutor(1) as pool:
+      assert pool.submit(nspace.threads.get).result() is None
+  assert nspace.threads.get() is None and names == {3}
+  for a,b in zip(serial,result):
+    assert type(a) == type(b) and np.shape(a) == np.shape(b) and np.allclose(a,b)
+    assert getattr(a,'keys',None) == getattr(b,'keys',None)
+
+def test_threads():
+  threads = Threads(workers=4,minsize=10)
+  a = np.arange(24.).reshape(4,3,2)
+  # Threads.call
+  assert np.array_equal(threads.call(np.multiply,(a,np.arange(2)),{}),a*np.arange(2))
+  assert np.array_equal(threads.call(np.add,(a,np.ones((1,3,1))),{'dtype':np.float32}),(a+1).astype(np.float32))
+  assert threads.call(np.add,(a,1),{}).dtype == a.dtype
+  assert np.array_equal(threads.call(np.add,(np.arange(5),1),{}),np.arange(1,6))
+  assert np.array_equal(threads.call(np.add,(a,[[[1]],[[2]],[[3]],[[4]]]),{}),a+[[[1]],[[2]],[[3]],[[4]]])
+  # outputs overlapping inputs other than themselves run serially (numpy buffers the input)
+  b = np.arange(64.*8).reshape(64,8)
+  expected = b + b[:1]
+  assert threads.call(np.add,(b,b[:1]),{'out':(b,)}) is b and np.array_equal(b,expected)
+  c,d = np.arange(64.*8).reshape(64,8),np.arange(64.*8).reshape(64,8)
+  assert np.array_equal(threads.call(np.add,(c,c[::-1]),{'out':(c,)}),np.add(d,d[::-1],out=d))
+  assert np.array_equal(threads.call(np.add,(c,1),{'out':(c,)}),d+1)
+  # Threads.reduce
+  assert np.array_equal(threads.reduce(np.add,a,(1,),{}),a.sum(axis=1,keepdims=True))
+  assert np.array_equal(threads.reduce(np.add,a,(0,2),{}),a.sum(axis=(0,2),keepdims=True))
+  assert np.array_equal(threads.reduce(np.subtract,a,(0,),{}),np.subtract.reduce(a,axis=0,keepdims=True))
+  threads.shutdown()
+
+def test_selector_threads():
+  X = data.Xijk.astype(float)
+  selector = Selector('s',data.space,i=['low','high'],j=[10,30])
+  with ThreadPoolExecutor(8) as pool:
+    results = list(pool.map(lambda _: selector(X),range(64)))
+    flats = list(pool.map(lambda _: selector.compile(X.shape),range(64)))
+  assert all(np.array_equal(r,results[0]) for r in results)
+  assert all(flat is flats[0] for flat in flats)
+  assert list(selector.pre) == [X.shape]
@@ -0,0 +1,50 @@
+import os
+import pytest
+import numpy as np
+from ndna.shard import ShardedArray,saveshards,loadshards
+from tests import data
+
+def test_saveshards(tmp_path):
+  dirname = str(tmp_path / 'X')
+  saveshards(dirname,data.Xijk,'i',workers=2)
+  assert sorted(os.listdir(dirname)) == ['index.json','shard-0.npy','shard-1.npy','shard-2.npy']
+  assert np.load(os.path.join(dirname,'shard-2.npy')).shape == (1,7,2)
+  with pytest.raises(ValueError,match='not in array keys'):
+    saveshards(dirname,data.Xik,'j')
+
+def test_shardedarray(tmp_path):
+  X = data.Xijk.astype(float)
+  for key in ['i','j','k']:
+    dirname = str(tmp_path / key)
+    saveshards(dirname,X,key)
+    S = loadshards(dirname,mmap_mode='r')
+    assert isinstance(S,ShardedArray) and S.shape == X.shape and S.keys == X.keys
+    # ShardedArray.__call__ & slice
+    for select in [
+        dict(i='high'),
+        dict(k='female',i='low'),
+        dict(i=['low','high']),
+        dict(i=['low','low']),
+        dict(j=slice(20,50)),
+        dict(j=[70,40,10]),
+        dict(i=['low','high','medium'],j=[10,20,50]),
+        dict(),
+      ]:
+      Y = S(**select)
+      assert Y.keys == X.keys and Y.shape == X(**select).shape
+      assert np.all(Y.view(np.ndarray) == X(**select).view(np.ndarray))
+      assert np.all(S.slice(**select).view(np.ndarray) == Y.view(np.ndarray))
+    # Selector
+    for selector in [data.si,data.sio,data.sik,data.sj3]:
+      assert np.all(selector(S).view(np.ndarray) == selector(X).view(np.ndarray))
+    # ShardedArray.load
+    assert np.all(S.load().view(np.ndarray) == X.view(np.ndarray))
+  # only the touched shards are opened
+  opened = []
+  S = loadshards(str(tmp_path / 'i'),space=data.space)
+  shard = S.shard
+  S.shard = lambda i: opened.append(i) or shard(i)
+  assert np.all(S(i='low',k='male') == X(i='low',k='male'))
+  assert opened == [2]
+  S(i=['high','medium'],j=20)
+  assert opened == [2,0,1]
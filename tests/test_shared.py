@@ -0,0 +1,52 @@
+import os
+import pickle
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from ndna.space import Dimension,Space,Array
+from ndna.shared import SharedArray,Pool,share,dumps
+from tests import data
+
+def work(shared):
+  X = shared.array
+  X[0] += 100
+  shared.close()
+  # the view keeps the block mapped after the handle is closed
+  return X.sum('j').keys,float(X.sum()),X.space is data.space
+
+def describe(X):
+  return os.getpid(),id(X.space),X * 2
+
+def test_share():
+  X = data.Xijk.astype(float)
+  with share(X) as shared:
+    assert isinstance(shared,SharedArray) and shared.owner
+    assert shared.array.keys == X.keys and shared.array.space is data.space
+    assert np.all(shared.array == X)
+    # SharedArray.__reduce__: only a handle is pickled
+    assert len(pickle.dumps(shared)) < X.nbytes
+    # zero-copy hand-off to a worker process, which writes into the same memory
+    with ProcessPoolExecutor(1) as pool:
+      assert pool.submit(work,shared).result() == (['i','k'],X.sum()+100*14,True)
+    assert np.all(shared.array[0] == X[0]+100) and np.all(shared.array[1:] == X[1:])
+    Y = shared.array
+  # views remain usable after the block is unlinked and the handle closed
+  shared.close()
+  assert Y.keys == X.keys and np.all(Y[0] == X[0]+100)
+  assert float(Y.sum()) == X.sum()+100*14
+
+def test_pool():
+  space = Space([Dimension('a','a',range(20000)),Dimension('b','b',['x','y'])])
+  X = Array(np.arange(40000.),space,['a','b'])
+  small = X(a=[0,1])
+  # Array.__reduce__: a plain pickle carries the whole space, once per pickle
+  assert len(pickle.dumps(small)) > 20000
+  assert len(pickle.dumps([small,small.copy()])) < len(pickle.dumps(small)) + small.nbytes + 200
+  # Pool: tasks and results refer to the space by position
+  assert len(dumps((describe,(small,),{}),{space:0})) < 1000
+  with Pool([space],workers=1) as pool:
+    results = list(pool.map(describe,[X,small,X(b='y')]))
+    assert pool.submit(describe,data.Xijk).result()[2].space is data.space
+  (pid,sid,Y),(pid2,sid2,_),(pid3,sid3,_) = results
+  # one worker: each task sees the same Space object, received at start-up
+  assert pid == pid2 == pid3 and sid == sid2 == sid3
+  assert Y.space is space and Y.keys == ['a','b'] and np.all(Y == X * 2)
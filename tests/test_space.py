@@ -1,26 +1,79 @@
 import pytest
 import numpy as np
+import pickle
 from copy import deepcopy
-from ndna.space import Dimension,Space,Array
+from ndna.space import Dimension,Space,Array,intern,positions,SharedBlock
+from ndna.io import dumpspace
 from tests import data
 
+def cellfun(i,j,k):
+  return j*(2 if k == 'male' else 3)
+
+def blockfun(i,j):
+  return np.char.str_len(i.astype(str))*j
+
 def test_dimension():
   # Dimensions.__init__
   with pytest.raises(TypeError,match='is not iterable'):
     Dimension('a','a',None)
     Dimension('a','a',0)
+  for labels in [[(1,2),(3,)],[(1,2),(3,4)]]:
+    dim = Dimension('t','t',labels)
+    assert dim.array.shape == (2,) and list(dim.values) == labels and dim.index(labels[1]) == 1
   # Dimension.name
   assert data.dims['sex'].name == 'sex'
   # Dimension.key
   assert data.dims['sex'].key == 'k'
   # Dimension.values
-  assert data.dims['sex'].values == ['male','female']
+  assert data.dims['sex'].values == ('male','female')
+  assert data.dims['age'].values is data.dims['age'].values
+  with pytest.raises(AttributeError):
+    data.dims['age'].values.append(80)
+  assert Dimension('m','m',[1,2.5]).values == (1,2.5) and type(Dimension('m','m',[1,2.5]).values[0]) is int
+  assert Dimension('t','t',[(1,2),(3,4)]).values == ((1,2),(3,4))
   # Dimension.__str__
   assert str(data.dims['sex']) == '< Dimension "sex" (k): [male,female] >'
   # Dimension.__repr__
   assert repr(data.dims['sex']) == 'sex (k)'
   # Dimension.__len__
   assert len(data.dims['sex']) == 2
+  # Dimension.lookup
+  assert data.dims['sex'].lookup == {'male':0,'female':1}
+  assert Dimension('d','d',['a','b','a']).index('a') == 0
+  # Dimension.array
+  assert tuple(data.dims['age'].array.tolist()) == data.dims['age'].values
+  # Dimension.index
+  assert data.dims['age'].index(30) == 2
+  with pytest.raises(ValueError,match='not in list of values for dimension "sex"'):
+    data.dims['sex'].index('other')
+  with pytest.raises(ValueError,match='not in list'):
+    data.dims['sex'].index(['male'])
+  # Dimension.ordered
+  assert data.dims['age'].ordered and not data.dims['sex'].ordered
+  # Dimension.range
+  assert data.dims['age'].range(slice(20,50)) == slice(1,5)
+  assert data.dims['age'].range(slice(None,25)) == slice(0,2)
+  assert data.dims['age'].range(slice(75,None)) == slice(7,7)
+  # Dimension.indices
+  assert data.dims['age'].indices(slice(30,None,2)).tolist() == [2,4,6]
+  assert data.dims['age'].indices([70,[10,20]]).tolist() == [6,0,1]
+  assert data.dims['age'].indices(np.array([[20,10],[20,70]])).tolist() == [[1,0],[1,6]]
+  assert data.dims['sex'].indices(np.array(['female','male'])).tolist() == [1,0]
+  with pytest.raises(ValueError,match='not in list'):
+    data.dims['age'].indices(np.array([10,15]))
+  # Dimension.__slots__
+  with pytest.raises(AttributeError):
+    data.dims['age'].other = 0
+  with pytest.raises(ValueError,match='read-only'):
+    data.dims['age'].array[0] = 0
+  # Dimension.__eq__ & __hash__
+  age = Dimension('age','j',[10,20,30,40,50,60,70])
+  assert age == data.dims['age'] and hash(age) == hash(data.dims['age'])
+  assert age != Dimension('age','j',[10,20,30,40,50,60,80])
+  assert age != Dimension('age','j',[10.,20.,30.,40.,50.,60.,70.])
+  assert data.dims['sex'] != Dimension('sex','k',['female','male'])
+  # Dimension.__reduce__
+  assert pickle.loads(pickle.dumps(data.dims['sex'])) == data.dims['sex']
 
 def test_space():
   # Space.__init__
@@ -50,6 +103,16 @@ def test_space():
   assert repr(data.space) == '< Space [i, j, k] >'
   # Space.__len__
   assert len(data.space) == 3
+  # Space.__eq__ & __hash__
+  space = Space([Dimension(**spec) for spec in dumpspace(data.space)])
+  assert space == data.space and hash(space) == hash(data.space)
+  assert space != Space(data.space.dims[::-1]) and space != Space(data.space.dims[:2])
+  with pytest.raises(AttributeError):
+    space.other = 0
+  # intern
+  assert intern(data.space) is data.space
+  assert intern(space) is data.space
+  assert pickle.loads(pickle.dumps(space)) is data.space
   # Space.keyfilter
   assert data.space.keyfilter([1,2,3],[]) == []
   assert data.space.keyfilter([1,2,3],['j']) == [2]
@@ -70,6 +133,34 @@ def test_space():
   assert list(data.space.iter([])) == [{}]
   assert list(data.space.iter(['x'])) == [{}]
   assert next(data.space.iter()) == {'i': 'high', 'j': 10, 'k': 'male'}
+  # Space.iterblocks
+  blocks = list(data.space.iterblocks(size=10))
+  assert len(blocks) == 5 and len(blocks[-1]['i']) == 2
+  assert [dict(zip(b,v)) for b in blocks for v in zip(*b.values())] == list(data.space.iter())
+  block = next(data.space.iterblocks(['k','j'],form='index'))
+  assert list(block) == ['j','k']
+  assert block['j'].tolist() == [0,0,1,1,2,2,3,3,4,4,5,5,6,6]
+  block = next(data.space.iterblocks(['i','k'],form='record'))
+  assert block.dtype.names == ('i','k') and block[1].tolist() == ('high','female')
+  assert list(data.space.iterblocks([])) == [{}]
+  with pytest.raises(ValueError,match='Unknown block form'):
+    next(data.space.iterblocks(form='x'))
+  # Space.map
+  A = data.space.map(cellfun,chunksize=5)
+  assert A.keys == ['i','j','k'] and A.dtype == float
+  assert A(i='low',j=70,k='female') == 210
+  assert np.all(data.space.map(cellfun,executor='thread',chunksize=5) == A)
+  C = data.space.map(cellfun,executor='process',chunksize=5,workers=2)
+  base = C
+  while isinstance(base,np.ndarray):
+    base = base.base
+  assert np.all(C == A) and isinstance(base,SharedBlock)
+  B = data.space.map(blockfun,['i','j'],blocks=True,executor='process',dtype=int)
+  assert B.shape == (3,7,1) and B.dtype == int
+  assert np.all(B(j=10) == np.array([[[40]],[[60]],[[30]]]))
+  assert data.space.map(lambda: 5,[]) == 5
+  with pytest.raises(ValueError,match='Unknown executor'):
+    data.space.map(cellfun,executor='x')
   # Space.subshape
   with pytest.raises(TypeError,match='is not iterable'):
     data.space.subshape(0)
@@ -81,8 +172,29 @@ def test_space():
   # Space.slicer
   assert data.space.slicer() == (slice(None),slice(None),slice(None))
   assert data.space.slicer(i='high') == (None,0,slice(None),slice(None))
-  assert str(data.space.slicer(j=[10,20])) == str(np.ix_(range(3),[0,1],range(2)))
-  assert str(data.space.slicer(['i','j'],j=[10,20])) == str(np.ix_(range(3),[0,1],[0]))
+  assert data.space.slicer(j=[10,20]) == (slice(None),slice(0,2,1),slice(None))
+  assert data.space.slicer(['i','j'],j=[10,20]) == (slice(None),slice(0,2,1),slice(0,1))
+  assert data.space.slicer(j=[70,40,10]) == (slice(None),slice(6,None,-3),slice(None))
+  assert data.space.slicer(j=[10],k='male') == (slice(None),slice(0,1),slice(0,1))
+  assert str(data.space.slicer(j=[10,20,40])) == str((slice(None),np.array([0,1,3]),slice(None)))
+  assert str(data.space.slicer(i=['low','high','medium'],j=[10,20,40])) == str(np.ix_([2,0,1],[0,1,3],range(2)))
+  assert data.space.slicer(j=slice(20,50)) == (slice(None),slice(1,5),slice(None))
+  assert data.space.slicer(j=slice(15,None,2)) == (slice(None),slice(1,7,2),slice(None))
+  with pytest.raises(ValueError,match='Range selection requires ordered'):
+    data.space.slicer(i=slice('high','low'))
+  # Space.cache
+  space = Space(data.space.dims,cachesize=2)
+  assert space.slicer(j=[10,20]) is space.slicer(j=[10,20])
+  assert (space.cache.hits,space.cache.misses) == (1,1)
+  space.slicer(['i'],j=[10,20])
+  space.slicer(i='high')
+  assert len(space.cache) == 2
+  assert space.slicer(j=np.array([10,20])) is space.slicer(j=[10,20])
+
+def test_positions():
+  assert [p.tolist() for p in positions((None,1,slice(None)),(3,2))] == [[1],[0,1]]
+  assert [p.tolist() for p in positions(np.ix_([0,2],[1]),(3,2))] == [[0,2],[1]]
+  assert [p.tolist() for p in positions((slice(1,3),),(3,2))] == [[1,2],[0,1]]
 
 def test_array():
   def update(X,arr,**kwargs):
@@ -95,6 +207,39 @@ def test_array():
     assert deepcopy(data.space) is Array(0,data.space,[]).space
   with pytest.raises(ValueError,match='Mismatched data shape and space shape'):
     Array([0,1,2],data.space,[])
+  assert Array(2,data.space,['i']).dtype == float
+  assert np.all(Array(2,data.space,['i']) == 2)
+  # Array.__reduce__
+  X = pickle.loads(pickle.dumps(data.Xijk(i='high')))
+  assert X.keys == ['i','j','k'] and X.space is data.space
+  assert np.all(X == data.Xijk(i='high'))
+  X,Y = pickle.loads(pickle.dumps([data.Xi,data.Xk]))
+  assert X.space is Y.space is data.space
+  B = pickle.loads(pickle.dumps(Array(2,data.space,['i','k'],broadcast=True)))
+  assert B.isbroadcast and B.shape == (3,1,2) and B.keys == ['i','k'] and np.all(B == 2)
+  # Array.__new__ (broadcast) & Array.isbroadcast & Array.materialize
+  B = Array(3,data.space,['i','j','k'],broadcast=True)
+  assert B.isbroadcast and B.dtype == int and B.shape == (3,7,2)
+  assert np.all(B == 3) and B.strides == (0,0,0)
+  assert Array(True,data.space,['k'],broadcast=True).dtype == bool
+  assert not data.Xijk.isbroadcast and data.Xijk.materialize() is data.Xijk
+  assert not B.materialize().isbroadcast and np.all(B.materialize() == B)
+  assert not (B + 1).isbroadcast
+  with pytest.raises(ValueError,match='Cannot update a broadcast Array'):
+    B.update(np.arange(7),i='high',k='male')
+  with pytest.raises(ValueError,match='Cannot update a broadcast Array'):
+    B.updatemany([({'k':'male'},1)])
+  with pytest.raises(ValueError,match='Cannot update a broadcast Array'):
+    B.updatetable({'i':['low'],'j':[10],'k':['male']},[1])
+  assert np.all(B == 3)
+  S = Array(3.,data.space,[],broadcast=True)
+  assert S.isbroadcast and S.shape == (1,1,1)
+  with pytest.raises(ValueError,match='Cannot update a broadcast Array'):
+    S.update(4.)
+  assert S.materialize().update(4.).sum() == 4 and pickle.loads(pickle.dumps(S)).isbroadcast
+  C = B.materialize()
+  assert C.update(np.arange(7),i='high',k='male') is C and C.keys == B.keys
+  assert np.all(C[0,:,0] == np.arange(7)) and np.all(B == 3)
   # TODO: test subclassing Array
   # Array.__getitem__
   assert data.Xijk[2,6,1] == (3*7*2)-1
@@ -103,10 +248,35 @@ def test_array():
   # Array.__call__
   assert data.Xijk(i='low',j=70,k='female') == (3*7*2)-1
   assert data.Xijk(i='high').shape == (1,7,2)
+  # views
+  V = deepcopy(data.Xijk)
+  assert np.shares_memory(V(j=[10,20,30]),V)
+  assert np.shares_memory(V(i=['high','low'],j=slice(20,50)),V)
+  assert np.all(V(j=slice(20,50)) == V[:,1:5,:])
+  V(j=[10,20,30])[...] = -1
+  assert np.all(V[:,:3,:] == -1)
+  assert np.all(V(j=[70,30,10]) == V[:,[6,2,0],:])
+  assert np.all(V(i=['high','low'],j=[10,20,40]) == V[np.ix_([0,2],[0,1,3],[0,1])])
   # Array.coords
   assert data.X.coords() == np.array([[[': 0.0']]])
   assert np.all(data.Xk.coords() == np.array([[['male  : 1.0','female: 2.0']]]))
   assert data.Xijk.coords()[0,0,0] == 'high  ,10,male  :  0.0'
+  # Array.rows
+  assert data.Xijk.rows(0,3).tolist() == ['high,10,male,0','high,10,female,1','high,20,male,2']
+  assert data.Xik.compact().rows(4,sep='\t').tolist() == ['low\tmale\t5','low\tfemale\t6']
+  assert data.Xk.rows(fmt='%.2f').tolist() == ['male,1.00','female,2.00']
+  assert Array(2.5,data.space,[]).rows().tolist() == ['2.5']
+  with pytest.raises(ValueError,match='sliced Array'):
+    data.Xijk(i='high').rows()
+  # Array.labels
+  space = Space([Dimension('a','a',['x,y','q"z','w'])])
+  assert Array([1,2,3],space,['a']).rows().tolist() == ['"x,y",1','"q""z",2','w,3']
+  assert Array([1,2,3],space,['a']).rows(sep=';').tolist() == ['x,y;1','"q""z";2','w;3']
+  # Array.__repr__
+  assert repr(data.Xk) == repr(data.Xk.view(np.ndarray)).replace('array','Array')
+  space = Space([Dimension('a','a',range(100)),Dimension('b','b',range(100))])
+  assert repr(Array(1.,space,['a','b'])).splitlines() == \
+    ['Array[a,b] shape (100, 100) float64 (10000 cells):']+['  0,{},1.0'.format(b) for b in range(10)]+['  ...']
   # Array.slice
   assert np.all(data.Xijk.slice() == data.Xijk)
   assert data.Xi.slice(i='high') == np.array([[[1]]])
@@ -132,3 +302,50 @@ def test_array():
   assert np.all(update(data.Xik,[11,12],i='high') == np.array([[[11,12]],[[3,4]],[[5,6]]]))
   assert np.all(update(data.Xik,[[11,12],[15,16]],i=['high','low']) ==\
                 np.array([[[11,12]],[[3,4]],[[15,16]]]))
+
+def test_array_scatter():
+  # Space.flatindex
+  assert data.space.flatindex((3,1,2),['i','k'],i='low').tolist() == [[[4,5]]]
+  assert data.space.flatindex((3,7,2),j=[10,20],k='male').shape == (3,2,1)
+  # Array.updatemany
+  X = Array(0.,data.space,['i','j','k'])
+  X.updatemany([({'i':'high','k':'male'},np.arange(7)),({'j':[10,20]},1.5),({'i':'low','j':70,'k':'female'},9)])
+  assert np.all(X[0,:,0] == [1.5,1.5,2,3,4,5,6])
+  assert np.all(X(j=[10,20]) == 1.5) and X[2,6,1] == 9
+  assert X.sum() == 1.5*12 + (2+3+4+5+6) + 9
+  X.updatemany([({'i':'high'},1),({'k':'male'},2)],accumulate=True)
+  assert X[0,2,0] == 5 and X[1,2,0] == 2 and X[0,2,1] == 1
+  assert X.updatemany([]) is X
+  Xc = Array(0,data.space,['i','k']).compact()
+  Xc.updatemany([({'i':'medium'},[4,5])])
+  assert np.all(Xc == [[0,0],[4,5],[0,0]])
+  # Array.updatetable
+  Y = Array(0.,data.space,['i','k'])
+  Y.updatetable({'i':['high','low','low'],'k':['male','female','female']},[1,2,3],accumulate=True)
+  assert np.all(Y.ravel() == [1,0,0,0,0,5])
+  Y.updatetable({'i':['high','low'],'k':['male','male']},[7,8])
+  assert np.all(Y.ravel() == [7,0,0,0,8,5])
+  with pytest.raises(ValueError,match='Missing column for key "k"'):
+    Y.updatetable({'i':['high']},1)
+  with pytest.raises(ValueError,match='not in list'):
+    Y.updatetable({'i':['x'],'k':['male']},1)
+  # Array.fromrecords
+  rows = [('high','male',1.),('low','female',2.),('high','male',3.)]
+  Y = Array.fromrecords(rows,data.space,['i','k'],duplicates='sum')
+  assert Y.keys == ['i','k'] and Y.shape == (3,1,2) and np.all(Y.ravel() == [4,0,0,0,0,2])
+  Y = Array.fromrecords(rows,data.space,['i','k'],duplicates='last',missing=np.nan)
+  assert np.array_equal(Y.ravel(),[3,np.nan,np.nan,np.nan,np.nan,2],equal_nan=True)
+  with pytest.raises(ValueError,match="Duplicate records for 1 cells, e.g. {'i': 'high', 'k': 'male'}"):
+    Array.fromrecords(rows,data.space,['i','k'])
+  with pytest.raises(ValueError,match='No records for 4 cells'):
+    Array.fromrecords(rows,data.space,['i','k'],duplicates='sum',missing='error')
+  with pytest.raises(ValueError,match='Unknown duplicates policy'):
+    Array.fromrecords(rows,data.space,['i','k'],duplicates='first')
+  with pytest.raises(ValueError,match='keys are required'):
+    Array.fromrecords(rows,data.space)
+  Y = Array.fromrecords({'k':np.array(['female','male']),'value':np.array([4,5])},data.space)
+  assert Y.keys == ['k'] and Y.dtype == int and np.all(Y.ravel() == [5,4])
+  Y = Array.fromrecords([{'j':20,'i':'low','x':1.5}],data.space,value='x')
+  assert Y.keys == ['i','j'] and Y(i='low',j=20) == 1.5 and Y.sum() == 1.5
+  records = np.array([('medium',30,'male',2.5)],dtype=[('i','U8'),('j',int),('k','U8'),('value',float)])
+  assert Array.fromrecords(records,data.space)(i='medium',j=30,k='male') == 2.5
@@ -0,0 +1,61 @@
+import pytest
+import numpy as np
+from ndna.sparse import SparseArray
+from ndna.space import Array
+from tests import data
+
+def sparse():
+  X = data.Xijk.astype(float).copy()
+  X[X % 5 != 0] = 0
+  return X,SparseArray.fromdense(X)
+
+def test_sparse_array():
+  X,S = sparse()
+  # SparseArray.__init__
+  E = SparseArray(0,data.space,['i','k'])
+  assert E.shape == (3,1,2) and E.nnz == 0
+  assert np.all(SparseArray(data.Xk,data.space,['k']).todense() == data.Xk)
+  # SparseArray.fromdense & SparseArray.todense
+  assert S.nnz == 8 and S.nbytes < X.nbytes
+  assert S.keys == ['i','j','k']
+  assert np.all(S.todense() == X)
+  assert str(S) == '< SparseArray [i, j, k] shape (3, 7, 2) nnz 8 >'
+  # SparseArray.__call__ & SparseArray.slice & SparseArray.__getitem__
+  assert np.all(S(i='high').todense() == X(i='high'))
+  assert np.all(S.slice(j=[10,30],k='female').todense() == X.slice(j=[10,30],k='female'))
+  assert np.all(S[{'i':'low'}].todense() == X[{'i':'low'}])
+  # Selector
+  assert np.all(data.si(S).todense() == data.si(X))
+  assert np.all(S[data.sj3.merge(data.si)].todense() == X[data.sj3.merge(data.si)])
+  # SparseArray.update
+  T = S.copy().update(7,i='high',k='male')
+  Y = X.copy().update([7]*7,i='high',k='male')
+  assert np.all(T.todense() == Y)
+  T.update([[1,0],[0,2]],i=['high','low'],j=20)
+  Y.update([[1,0],[0,2]],i=['high','low'],j=20)
+  assert np.all(T.todense() == Y)
+  assert S.nnz == 8
+  assert E.update(3,i='low',k='female').nnz == 1
+  Z = SparseArray(0,data.space,['i','k'])
+  assert Z.dtype == Array(0,data.space,['i','k']).dtype == float
+  assert Z.update(2.5,i='high',k='male').todense()(i='high',k='male') == 2.5
+  assert SparseArray(data.Xik,data.space,['i','k']).update(0.5,i='low',k='male').dtype == float
+  # operators
+  assert np.all((S+T).todense() == X+Y)
+  assert np.all((S-T).todense() == X-Y)
+  assert np.all((S*T).todense() == X*Y)
+  assert np.all((-S).todense() == -X)
+  assert np.all((S*data.Xi).todense() == X*data.Xi)
+  assert np.all((data.Xik*S).todense() == X*data.Xik)
+  assert isinstance(data.Xik*S,SparseArray)
+  assert np.all((S/2).todense() == X/2)
+  assert np.all((2*S).todense() == 2*X)
+  assert (S+0).nnz == S.nnz
+  with pytest.raises(ValueError,match='dense result'):
+    S+1
+  with pytest.raises(ValueError,match='dense result'):
+    1/S
+  with pytest.raises(ValueError,match='same shape'):
+    S+E
+  with pytest.raises(ValueError,match='Cannot broadcast'):
+    E*data.Xijk
@@ -0,0 +1,68 @@
+import threading
+import numpy as np
+from ndna import stats
+from ndna.space import Space,Array
+from ndna.ops import Selector
+from tests import data
+
+def test_collect():
+  new,ufunc = Array.__new__,Array.__array_ufunc__
+  data.space.cache.clear()
+  with stats.collect() as rec:
+    data.Xijk(i='high')
+    data.Xijk(i='high')
+    data.Xijk(i=['low','high','medium'],j=[10,20,50])
+    s = Selector('s',data.space,i='low')
+    s(data.Xijk)
+    s(data.Xijk)
+    Array([1,2,3],space=data.space,keys=['i'])
+    Array(0,space=data.space,keys=['i'],broadcast=True)
+    Y = data.Xijk + data.Xi
+    np.add(Y,1,out=Y)
+  # Registry.count
+  assert rec.count('Space.slicer') == 4
+  assert rec.count('Space.slicer','hit') == 1
+  assert rec.count('Space.compile','fast') == 2
+  assert rec.count('Space.compile','ix') == 1
+  assert rec.count('Selector.pre','miss') == 1 and rec.count('Selector.pre','hit') == 1
+  assert rec.count('Array.__new__','copy') == 1 and rec.count('Array.__new__','view') == 1
+  # Registry.totals
+  totals = rec.totals()
+  assert totals[('Array.ufunc','copy')][:2] == [1,Y.nbytes]
+  assert totals[('Array.ufunc','inplace')][:2] == [1,0]
+  assert all(seconds >= 0 for _,_,seconds in totals.values())
+  # Registry.summary
+  summary = rec.summary()
+  assert summary.splitlines()[0].split() == ['event','detail','calls','bytes','seconds','site']
+  assert 'test_stats.py' in summary and 'space.py' not in summary
+  # uninstalled on exit
+  assert Array.__new__ is new and Array.__array_ufunc__ is ufunc
+  assert 'wrapper' not in Space.slicer.__qualname__
+  data.Xijk(i='low')
+  assert rec.count('Space.slicer') == 4
+
+def test_collect_threads():
+  # overlapping collect() contexts in two threads, exiting in the opposite order
+  new = Array.__new__
+  entered,exited,recs = threading.Barrier(2),threading.Event(),{}
+  def work(name,calls,first):
+    with stats.collect() as rec:
+      entered.wait()
+      for _ in range(calls):
+        data.Xijk(i='high')
+      if first:
+        exited.wait()
+    if not first:
+      exited.set()
+    recs[name] = rec
+  threads = [threading.Thread(target=work,args=('a',2,True)),threading.Thread(target=work,args=('b',3,False))]
+  for thread in threads:
+    thread.start()
+  with stats.collect() as rec:
+    data.Xijk(i='low')
+  for thread in threads:
+    thread.join()
+  assert rec.count('Space.slicer') == 1
+  assert recs['a'].count('Space.slicer') == 2 and recs['b'].count('Space.slicer') == 3
+  assert Array.__new__ is new and 'wrapper' not in Space.slicer.__qualname__
+  assert stats.active == 0
@@ -1,5 +1,8 @@
+import time
+import pickle
+from concurrent.futures import ThreadPoolExecutor
 import pytest
-from ndna.utils import odict,unique,dictmerge,olen,flatten
+from ndna.utils import odict,unique,dictmerge,olen,flatten,freeze,LRUCache
 
 def test_unique():
   assert unique([1]) == [1]
@@ -47,3 +50,37 @@ def test_olen():
   assert olen('test') == 1
   assert olen([]) == 0
   assert olen([0,1,2]) == 3
+
+def test_freeze():
+  assert freeze(1) == 1
+  assert freeze('ab') == 'ab'
+  assert freeze([1,[2,3]]) == (1,2,3)
+  assert freeze({'b':[1],'a':2}) == (('a',2),('b',(1,)))
+  assert freeze(slice(1,None)) == ('slice',1,None,None)
+  hash(freeze({'a':[1,2],'b':slice(3)}))
+
+def test_lrucache():
+  cache = LRUCache(2)
+  assert cache.fetch('a',lambda: 1) == 1
+  assert cache.fetch('a',lambda: 2) == 1
+  assert (cache.hits,cache.misses) == (1,1)
+  cache.fetch('b',lambda: 2)
+  cache.fetch('a',lambda: 0)
+  cache.fetch('c',lambda: 3)
+  assert 'b' not in cache and 'a' in cache and len(cache) == 2
+  cache.clear()
+  assert (len(cache),cache.hits,cache.misses) == (0,0,0)
+  nocache = LRUCache(0)
+  nocache.fetch('a',lambda: 1)
+  assert len(nocache) == 0
+  # thread safety: each entry is computed once
+  calls = []
+  def slow():
+    calls.append(1)
+    time.sleep(0.01)
+    return object()
+  with ThreadPoolExecutor(8) as pool:
+    values = list(pool.map(lambda _: cache.fetch('x',slow),range(16)))
+  assert len(calls) == 1 and all(value is values[0] for value in values)
+  cache = pickle.loads(pickle.dumps(cache))
+  assert 'x' in cache and cache.fetch('y',lambda: 1) == 1